@@ -1,48 +1,205 @@
-import zmq, os, sys
+import zmq, os
 import numpy as np
 import uuid
 import time
+import atexit
+import itertools
+import threading
+import weakref
 import msgpack
+import protocol
+import shm_utils
+from collections import OrderedDict, defaultdict
 from multiprocessing import shared_memory
 
-LOCAL_CLONE = '/CX/neuro_tracking/xinr/cloudvolume_test/Cloudvolume'
-if os.path.exists(LOCAL_CLONE):
-    sys.path.insert(0, LOCAL_CLONE)
-
 from cloudvolume.lib import Bbox
 
+# =============================================================================
+# 共享内存池 (按 2 的幂分桶复用)
+# =============================================================================
+class ShmPool:
+    """
+    客户端共享内存池。
+    缓冲区按 2 的幂分桶，释放后保留映射供同一桶的后续请求复用，
+    避免每次请求都走 shm_open + ftruncate + mmap + munmap + shm_unlink。
+    池内缓冲区总量超出预算时按 LRU 淘汰空闲缓冲区 (unlink)，只保留最近归还的一块 (其桶不超过预算时)，
+    因此全部缓冲区归还后总量不超过预算；使用中的缓冲区不计入淘汰。
+    有可用的 hugetlbfs 时优先用大页创建缓冲区，否则使用 /dev/shm。
+    """
+    MIN_BUCKET = 2 * 1024**2
+
+    def __init__(self, budget_bytes):
+        self.budget_bytes = budget_bytes
+        # 缓冲区名字 = 进程内唯一前缀 + 自增序号，避免每次创建都调用 uuid4 (os.urandom)
+        self._name_prefix = f"{os.getpid()}_{uuid.uuid4().hex[:8]}_shm_"
+        self._name_counter = itertools.count()
+        self._lock = threading.Lock()
+        self._segments = {}                 # name -> SharedMemory / MmapShm (池内全部缓冲区)
+        self._buckets = {}                  # name -> bucket
+        self._free = defaultdict(list)      # bucket -> [name] 空闲列表
+        self._idle = OrderedDict()          # name -> bucket, 空闲缓冲区的 LRU 顺序
+        self._clean = set()                 # 创建后尚未交给 Worker 写入的缓冲区 (内核保证全 0)
+        self._total_bytes = 0
+        self._closed = False
+
+    @classmethod
+    def bucket_size(cls, nbytes):
+        """向上取整到 2 的幂 (不小于 MIN_BUCKET)"""
+        return max(cls.MIN_BUCKET, 1 << (int(nbytes) - 1).bit_length())
+
+    def acquire(self, nbytes):
+        """
+        获取一块至少 nbytes 的缓冲区，返回 (name, shm, fresh)。
+        fresh=True 表示缓冲区从未被写过 (shm_open + ftruncate 得到的页全为 0)。
+        """
+        bucket = self.bucket_size(nbytes)
+        with self._lock:
+            free = self._free.get(bucket)
+            if free:
+                name = free.pop()
+                del self._idle[name]
+                fresh = name in self._clean
+                self._clean.discard(name)
+                return name, self._segments[name], fresh
+
+        name, shm = self._create(bucket)
+        with self._lock:
+            self._segments[name] = shm
+            self._buckets[name] = bucket
+            self._total_bytes += bucket
+        return name, shm, True
+
+    def release(self, name):
+        """归还缓冲区；池已关闭或不属于本池时直接 unlink"""
+        with self._lock:
+            bucket = self._buckets.get(name)
+            if bucket is None:
+                return
+            if self._closed:
+                self._drop_locked(name)
+                return
+            self._free[bucket].append(name)
+            self._idle[name] = bucket
+            self._evict_locked()
+
+    def discard(self, name):
+        """从池中移除并 unlink，不再复用 (例如 Worker 可能仍在写入)"""
+        with self._lock:
+            if name in self._segments:
+                self._drop_locked(name)
+
+    def prewarm(self, nbytes, count=1):
+        """
+        预先创建 count 块对应桶大小的缓冲区 (tmpfs 按需分配物理页，创建本身很便宜)。
+        块数以预算能容纳的为限，一块都放不下时跳过 (否则归还时立即被淘汰，白白创建一次)。
+        """
+        count = min(count, self.budget_bytes // self.bucket_size(nbytes))
+        if count <= 0:
+            return
+        acquired = [self.acquire(nbytes) for _ in range(count)]
+        for name, _, _ in acquired:
+            self.release(name)
+        # 预热时新建的缓冲区没有被写过，仍视为全 0
+        with self._lock:
+            self._clean.update(name for name, _, fresh in acquired if fresh and name in self._segments)
+
+    def close(self):
+        """unlink 所有空闲缓冲区；仍在使用中的缓冲区在归还时 unlink"""
+        with self._lock:
+            self._closed = True
+            for name in list(self._idle):
+                self._drop_locked(name)
+
+    def _create(self, bucket):
+        name = f"{self._name_prefix}{next(self._name_counter)}"
+        shm = shm_utils.create_hugepage_shm(name, bucket)
+        if shm is None:
+            shm = shared_memory.SharedMemory(create=True, size=bucket, name=name)
+            shm_utils.advise_hugepage(shm)
+        return shm.name, shm
+
+    def _evict_locked(self):
+        # 从最久未用的空闲缓冲区开始淘汰 (各桶仅有的一块同样淘汰，否则用过的每个桶都会一直占着内存)；
+        # 最近归还的一块留作下个请求的热缓冲区，除非它本身就超出预算
+        keep = next(reversed(self._idle), None)
+        if keep is not None and self._buckets[keep] > self.budget_bytes:
+            keep = None
+        for name in list(self._idle):
+            if self._total_bytes <= self.budget_bytes:
+                break
+            if name != keep:
+                self._drop_locked(name)
+
+    def _drop_locked(self, name):
+        shm = self._segments.pop(name)
+        bucket = self._buckets.pop(name)
+        if self._idle.pop(name, None) is not None:
+            self._free[bucket].remove(name)
+        self._total_bytes -= bucket
+        self._clean.discard(name)
+        try:
+            shm.close()
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+
 # =============================================================================
 # 自动回收的 Numpy 数组 (RAII Pattern)
 # =============================================================================
-class AutoReleaseArray(np.ndarray):
-    def __new__(cls, shape, dtype, shm_name, order='F'):
+class _ShmBuffer:
+    """
+    以 __array_interface__ 把共享内存暴露给 numpy。
+    返回数组及其所有视图的 base 都是它 (numpy 会把 base 链折叠到第一个非 ndarray 对象)，
+    因此最后一个视图被回收时才会触发释放。
+    """
+    __slots__ = ('__array_interface__', '__weakref__')
+
+
+def _release_shm(shm, shm_name, pool, opened):
+    try:
+        # 只关闭自己打开的句柄；池中的句柄由池持有
+        if opened:
+            shm.close()
+        # 池化的缓冲区归还给池复用，否则直接 unlink
+        if pool is not None:
+            pool.release(shm_name)
+            return
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+    except Exception as e:
+        print(f"Error in AutoReleaseArray finalizer: {e}")
+
+
+def AutoReleaseArray(shape, dtype, shm_name, order='F', pool=None, shm=None):
+    """
+    返回直接映射共享内存的普通 np.ndarray，回收时自动归还/unlink 缓冲区。
+    不再使用 ndarray 子类，切片、reshape 等操作不会触发 __array_finalize__。
+    """
+    # 传入已打开的 shm (例如池中的句柄) 时直接复用，省去一次 shm_open + mmap
+    opened = shm is None
+    if opened:
         try:
-            shm = shared_memory.SharedMemory(name=shm_name)
+            shm = shm_utils.attach_shared_memory(shm_name)
         except FileNotFoundError:
             raise RuntimeError(f"SharedMemory '{shm_name}' not found.")
 
-        obj = super().__new__(cls, shape, dtype=dtype, buffer=shm.buf, order=order)
-        obj._shm = shm
-        obj._shm_name = shm_name
-        obj._owns_memory = True
-        return obj
+    # 临时视图只用于生成 __array_interface__，不保留对 shm.buf 的导出，finalizer 里才能 close
+    holder = _ShmBuffer()
+    holder.__array_interface__ = np.ndarray(shape, dtype=dtype, buffer=shm.buf, order=order).__array_interface__
+    weakref.finalize(holder, _release_shm, shm, shm_name, pool, opened)
+    return np.asarray(holder)
 
-    def __array_finalize__(self, obj):
-        if obj is None: return
-        self._shm = getattr(obj, '_shm', None)
-        self._shm_name = getattr(obj, '_shm_name', None)
-        self._owns_memory = False
+# =============================================================================
+# 等待中的请求 (由 IO 线程填充响应并唤醒调用方)
+# =============================================================================
+class _PendingResponse:
+    __slots__ = ('event', 'resp')
 
-    def __del__(self):
-        try:
-            if getattr(self, '_owns_memory', False) and hasattr(self, '_shm') and self._shm:
-                self._shm.close()
-                try: 
-                    self._shm.unlink()
-                except FileNotFoundError:
-                    pass
-        except Exception as e:
-            print(f"Error in AutoReleaseArray destructor: {e}")
+    def __init__(self):
+        self.event = threading.Event()
+        self.resp = None
 
 # =============================================================================
 # 客户端代理 (Client Proxy)
@@ -50,8 +207,16 @@ class AutoReleaseArray(np.ndarray):
 class ClientProxy:
     # 大于此的请求走云
     SHM_THRESHOLD = 2000*2000*2000
+    # 共享内存池预算下限 (空闲缓冲区超出后按 LRU unlink)；实际预算至少容纳一块阈值大小的缓冲区
+    SHM_POOL_BUDGET = 16 * 1024**3
+    # 高水位: 突发请求时避免因 HWM 阻塞
+    SOCKET_HWM = 10000
+    # 直连请求超过此时长 (秒) 未返回时视该 Worker 已下线: 关闭直连，在途请求改经 Scheduler 重发
+    DIRECT_TIMEOUT = 120
+    # 有在途直连请求时 IO 线程检查超时的间隔 (毫秒)
+    DIRECT_CHECK_MS = 1000
 
-    def __init__(self, scheduler_addr, vol):
+    def __init__(self, scheduler_addr, vol, prewarm=1, direct=True, pool_budget=None):
         self.cv = vol
         self.cv.cache_thread = 0
         self.cv.partial_decompress_parallel = 1
@@ -61,99 +226,342 @@ class ClientProxy:
         self.num_channels = vol.meta.num_channels
         self.order = 'F'
         self.scheduler_addr = scheduler_addr
+
+        # 请求头中的定长字段只需计算一次
+        self._dtype_code = protocol.DTYPE_CODES[str(self.meta_dtype)]
+        self._itemsize = self.meta_dtype.itemsize
+        self._bg_color = int(self.background_color)
+        self._order_code = self.order.encode()
+        # req_id = b"{pid}_req_{序号}"，调度器据此解析 PID
+        self._req_prefix = f"{os.getpid()}_req_".encode()
+        self._req_counter = itertools.count()
         
-        self.context = zmq.Context()
+        self.context = zmq.Context(io_threads=1)
         self.socket = self.context.socket(zmq.DEALER)
         self.socket.identity = self.client_id.encode('utf-8')
-        self.socket.connect(scheduler_addr)
-        
-        self.poller = zmq.Poller()
-        self.poller.register(self.socket, zmq.POLLIN)
+        # libzmq 对 TCP 连接默认开启 TCP_NODELAY，这里只需调整其余选项
+        self.socket.setsockopt(zmq.LINGER, 0)
+        self.socket.setsockopt(zmq.TCP_KEEPALIVE, 1)
+        self.socket.setsockopt(zmq.IMMEDIATE, 1)
+        self.socket.setsockopt(zmq.SNDHWM, self.SOCKET_HWM)
+        self.socket.setsockopt(zmq.RCVHWM, self.SOCKET_HWM)
+        self.socket.connect(protocol.resolve_local_endpoint(scheduler_addr))
+
+        # DEALER socket 只由 IO 线程使用 (ZMQ socket 非线程安全)。
+        # 调用方线程通过 inproc PUSH 提交请求，IO 线程转发并按 req_id 分发响应。
+        outbox_addr = f"inproc://outbox-{self.client_id}"
+        self._outbox_pull = self.context.socket(zmq.PULL)
+        self._outbox_pull.bind(outbox_addr)
+        self._outbox = self.context.socket(zmq.PUSH)
+        self._outbox.connect(outbox_addr)
+        self._send_lock = threading.Lock()
+
+        self._pending = {}          # req_id -> _PendingResponse
+        self._pending_lock = threading.Lock()
+
+        # 直连 Worker (仅由 IO 线程访问): 从 RESULT 中获知 Worker 端点后，
+        # READ 请求直接发给 Scheduler 最近一次为本 Client 分配的 Worker (沿用其亲和 / 空间 / 轮询策略的选择)；
+        # 该 Worker 忙碌或尚未建立直连时仍交给 Scheduler 分配
+        self.direct = direct
+        self._direct_socks = {}             # worker_id -> DEALER
+        self._affinity_worker = None        # Scheduler 最近一次分配的 worker_id
+        self._direct_busy = defaultdict(int) # worker_id -> 在途的直连请求数
+        self._direct_reqs = {}              # req_id -> (worker_id, 请求, 发出时间)
+        self._epoch = None                  # Scheduler 的 Worker 成员版本 (RESULT 前的一帧)
+        self._io_thread = threading.Thread(target=self._io_loop, name=f"{self.client_id}-io", daemon=True)
+        self._io_thread.start()
+
+        # 走共享内存的请求至少为阈值大小 (uint64 单通道即 64GB)，固定的 16GB 预算连一个桶都放不下，
+        # 归还时会全部被淘汰；默认预算按 prewarm 块阈值大小的桶计算，pool_budget 可显式指定
+        threshold_bytes = self.SHM_THRESHOLD * self.num_channels * self._itemsize
+        if pool_budget is None:
+            pool_budget = max(self.SHM_POOL_BUDGET, max(prewarm, 1) * ShmPool.bucket_size(threshold_bytes))
+        self._pool = ShmPool(pool_budget)
+        # 预热阈值大小对应的桶，首个大请求无需现场创建共享内存 (预算放不下时 prewarm 自动跳过)
+        if prewarm:
+            self._pool.prewarm(threshold_bytes, count=prewarm)
+        atexit.register(self._pool.close)
 
         print(f"[Client] Started {self.client_id}")
 
     def __getitem__(self, slices):
         time_0 = time.perf_counter()
-        bbox = Bbox.from_slices(slices)
-        shape = list(bbox.size3()) + [ self.num_channels ]
-        req_size = int(np.prod(shape))
-        req_size_bytes = int(req_size * self.meta_dtype.itemsize)
-
-        if np.prod(shape) == 0:
-            raise ValueError(f"Requested empty shape: {shape}")
+        bbox_list, shape, req_size, req_size_bytes = self._parse_slices(slices)
 
         if req_size < self.SHM_THRESHOLD:
-            return self.cv[bbox]
+            return self.cv[Bbox(bbox_list[:3], bbox_list[3:])]
         
-        shm_name = self._init_shared_buffer_raw(req_size_bytes)
+        shm_name, shm, fresh = self._init_shared_buffer_raw(req_size_bytes)
         
         time_1 = time.perf_counter()
+        req_id = self._new_req_id()
         try:
-            req_id = f"{os.getpid()}_req_{uuid.uuid4().hex[:8]}"
-            self._send_request(req_id, bbox, shm_name, shape, req_size_bytes)
+            slots = self._register([req_id])
+            self._send_request(req_id, bbox_list, shm_name, shape, req_size_bytes, fresh)
             
-            self._wait_response(req_id)
+            self._wait_response([req_id], slots)
             time_2 = time.perf_counter()
             
             result_arr = AutoReleaseArray(
                 shape=shape,
                 dtype=self.meta_dtype,
                 shm_name=shm_name,
-                order=self.order
+                order=self.order,
+                pool=self._pool,
+                shm=shm
             )
             # print(f"Shm Request time:{(time_1-time_0)*1000}ms, _wait_response:{(time_2-time_1)*1000}ms, AutoReleaseArray construct:{(time.perf_counter()-time_2)*1000}ms")
             return result_arr
 
         except Exception as e:
-            self._manual_cleanup(shm_name)
+            self._manual_cleanup(shm_name, discard=isinstance(e, TimeoutError))
             raise e
 
+    def getitem_batch(self, slices_list):
+        """
+        批量请求：走共享内存的请求合并为一帧发送，等待全部完成后按输入顺序返回结果列表。
+        小请求仍由本地 cv 直接读取。
+        """
+        results = [None] * len(slices_list)
+        pending = []    # (idx, req_id, shm_name, shm, shape)
+        msgs = []
+        try:
+            for idx, slices in enumerate(slices_list):
+                bbox_list, shape, req_size, req_size_bytes = self._parse_slices(slices)
+                if req_size < self.SHM_THRESHOLD:
+                    results[idx] = self.cv[Bbox(bbox_list[:3], bbox_list[3:])]
+                    continue
+
+                shm_name, shm, fresh = self._init_shared_buffer_raw(req_size_bytes)
+                req_id = self._new_req_id()
+                pending.append((idx, req_id, shm_name, shm, shape))
+                msgs.append(self._pack_request(req_id, bbox_list, shm_name, shape, req_size_bytes, fresh))
+
+            if msgs:
+                req_ids = [req_id for _, req_id, _, _, _ in pending]
+                slots = self._register(req_ids)
+                self._send(protocol.pack_batch(msgs))
+                self._wait_response(req_ids, slots)
+
+        except Exception as e:
+            for _, _, shm_name, _, _ in pending:
+                self._manual_cleanup(shm_name, discard=isinstance(e, TimeoutError))
+            raise e
+
+        for idx, req_id, shm_name, shm, shape in pending:
+            results[idx] = AutoReleaseArray(
+                shape=shape,
+                dtype=self.meta_dtype,
+                shm_name=shm_name,
+                order=self.order,
+                pool=self._pool,
+                shm=shm
+            )
+        return results
+
+    def _parse_slices(self, slices):
+        """解析切片，返回 (bbox 列表 [x1, y1, z1, x2, y2, z2], shape, 元素个数, 字节数)"""
+        bbox_list = self._slices_to_list(slices)
+        # 纯 Python 整数运算，避免 np.prod 创建 0 维数组
+        sx = bbox_list[3] - bbox_list[0]
+        sy = bbox_list[4] - bbox_list[1]
+        sz = bbox_list[5] - bbox_list[2]
+
+        # num_channels 恒大于 0，只需检查三个空间维度
+        if not (sx and sy and sz):
+            raise ValueError(f"Requested empty shape: {[sx, sy, sz, self.num_channels]}")
+
+        req_size = sx * sy * sz * self.num_channels
+        shape = [sx, sy, sz, self.num_channels]
+        return bbox_list, shape, req_size, req_size * self._itemsize
+
+    @staticmethod
+    def _slices_to_list(slices):
+        """
+        常见的 3 个整数切片 (无 step) 直接读取 start/stop，不构造 Bbox；
+        其余写法交给 Bbox.from_slices 解析。
+        """
+        if type(slices) is tuple and len(slices) == 3:
+            s0, s1, s2 = slices
+            if type(s0) is slice and type(s1) is slice and type(s2) is slice \
+                    and s0.step is None and s1.step is None and s2.step is None:
+                bbox_list = [s0.start, s1.start, s2.start, s0.stop, s1.stop, s2.stop]
+                if all(type(c) is int for c in bbox_list):
+                    return bbox_list
+
+        return [int(c) for c in Bbox.from_slices(slices).to_list()]
+
+    def _new_req_id(self):
+        return self._req_prefix + str(next(self._req_counter)).encode()
+
     def _init_shared_buffer_raw(self, nbytes):
+        # 从池中取缓冲区 (命中时无需任何内核分配)，返回 (name, 已打开的 shm, 是否全 0)；Worker 按名字 attach
+        return self._pool.acquire(nbytes)
+
+    def _pack_request(self, req_id, bbox_list, shm_name, shape, size_bytes, fresh=False):
+        # 定长二进制头 + req_id/shm_name，替代 msgpack dict
+        # 全新缓冲区本身就是全 0，背景色也为 0 时 Worker 无需填充
+        needs_fill = not (fresh and self._bg_color == 0)
+        return protocol.pack_read(
+            req_id, bbox_list, shape, shm_name.encode(),
+            size_bytes, self._bg_color, self._dtype_code, self._order_code, needs_fill
+        )
 
-        unique_name = f"{os.getpid()}_shm_{uuid.uuid4().hex}"
-        # shm = shared_memory.SharedMemory(create=True, size=int(nbytes), name=unique_name)
-        # shm.close() # 关闭句柄，但不 unlink
-        return unique_name
-
-    def _send_request(self, req_id, bbox, shm_name, shape, size_bytes):
-        bbox_list = [int(c) for c in bbox.to_list()]
-        shape_list = [int(s) for s in shape]
-
-        payload = {
-            "type": "READ",
-            "req_id": req_id,
-            "bbox": bbox_list,        
-            "shape": shape_list,
-            "dtype": str(self.meta_dtype),
-            "shm_name": shm_name,
-            "order": self.order,
-            "data_size": int(size_bytes),
-            "bg_color": self.background_color
-        }
-        self.socket.send(msgpack.packb(payload))
-
-    def _wait_response(self, req_id, timeout_ms= 1000 * 1000):
-        start_time = time.time()
+    def _send(self, msg):
+        # 多个调用方线程共用 outbox，串行化提交
+        with self._send_lock:
+            self._outbox.send(msg)
+
+    def _send_request(self, req_id, bbox_list, shm_name, shape, size_bytes, fresh=False):
+        self._send(self._pack_request(req_id, bbox_list, shm_name, shape, size_bytes, fresh))
+
+    def _register(self, req_ids):
+        """在发送前登记等待槽位，保证响应到达时一定能找到等待者"""
+        slots = [_PendingResponse() for _ in req_ids]
+        with self._pending_lock:
+            self._pending.update(zip(req_ids, slots))
+        return slots
+
+    def _io_loop(self):
+        """IO 线程：转发调用方提交的请求，接收响应并唤醒对应的等待者"""
+        poller = zmq.Poller()
+        poller.register(self.socket, zmq.POLLIN)
+        poller.register(self._outbox_pull, zmq.POLLIN)
         while True:
-            socks = dict(self.poller.poll(timeout_ms))
-            if self.socket in socks and socks[self.socket] == zmq.POLLIN:
-                msg = self.socket.recv_multipart()
-                msg = msg[-1]
-                resp = msgpack.unpackb(msg)
-                
-                if resp.get('req_id') == req_id:
-                    if resp['status'] == 'OK':
-                        return
-                    else:
-                        raise RuntimeError(f"Worker Error: {resp.get('error')}")
-            
-            if (time.time() - start_time) * 1000 > timeout_ms:
+            socks = dict(poller.poll(self.DIRECT_CHECK_MS if self._direct_reqs else None))
+            if self._direct_reqs:
+                self._expire_direct(poller)
+            if self._outbox_pull in socks:
+                while True:
+                    try:
+                        msg = self._outbox_pull.recv(zmq.NOBLOCK)
+                    except zmq.Again:
+                        break
+                    self._route(msg)
+
+            # 响应可能来自 Scheduler 或任一直连 Worker
+            for sock in socks:
+                if sock is self._outbox_pull or sock.closed:
+                    # 直连可能刚在超时 / 成员变化时被关闭
+                    continue
+                while True:
+                    try:
+                        frames = sock.recv_multipart(zmq.NOBLOCK)
+                    except zmq.Again:
+                        break
+                    # Scheduler 转发的结果为 [b"", epoch, RESULT]，直连 Worker 的为 [RESULT]
+                    if len(frames) == 3 and frames[1] != self._epoch:
+                        self._on_epoch(frames[1], poller)
+                    # RESULT 中没有数组字段，use_list=False 省去 list 分配
+                    resp = msgpack.unpackb(frames[-1], use_list=False)
+                    self._on_response(resp, poller)
+
+    def _route(self, msg):
+        """
+        单条 READ 请求在 Scheduler 最近分配的 Worker 空闲时直接发给它；
+        该 Worker 未知 / 忙碌 / 连接未建立，或为批量请求时交给 Scheduler (其选择会更新 _affinity_worker)
+        """
+        worker_id = self._affinity_worker
+        sock = self._direct_socks.get(worker_id)
+        if sock is not None and not self._direct_busy[worker_id] and protocol.is_read(msg):
+            try:
+                sock.send(msg, zmq.NOBLOCK)
+            except zmq.Again:
+                # 连接尚未建立或 Worker 已下线，留给 Scheduler
+                pass
+            else:
+                self._direct_busy[worker_id] += 1
+                self._direct_reqs[protocol.read_req_id(msg)] = (worker_id, msg, time.monotonic())
+                return
+        self.socket.send(msg)
+
+    def _expire_direct(self, poller):
+        """
+        直连请求超时: 该 Worker 视为已下线，关闭直连并把发给它的在途请求全部改经 Scheduler 重发
+        (Scheduler 已移除它时会分配给其他 Worker)，调用方不必等到 _wait_response 超时
+        """
+        now = time.monotonic()
+        expired = {worker_id for worker_id, _, sent in self._direct_reqs.values() if now - sent > self.DIRECT_TIMEOUT}
+        for worker_id in expired:
+            print(f"[ClientProxy] Direct worker {worker_id} timed out, falling back to scheduler")
+            self._close_direct(worker_id, poller)
+            for req_id, (owner, msg, _) in list(self._direct_reqs.items()):
+                if owner == worker_id:
+                    del self._direct_reqs[req_id]
+                    self.socket.send(msg)
+
+    def _on_epoch(self, epoch, poller):
+        """
+        Scheduler 的 Worker 成员有变化 (注册或移除): 忘记上次的分配，关闭没有在途请求的直连，
+        之后的请求先经 Scheduler，由其 RESULT 重新建立仍在线 Worker 的直连
+        """
+        if self._epoch is not None:
+            self._affinity_worker = None
+            for worker_id in list(self._direct_socks):
+                if not self._direct_busy[worker_id]:
+                    self._close_direct(worker_id, poller)
+        self._epoch = epoch
+
+    def _on_response(self, resp, poller):
+        req_id = resp.get('req_id')
+        entry = self._direct_reqs.pop(req_id, None)
+        if entry is not None:
+            self._direct_busy[entry[0]] -= 1
+
+        # Scheduler 转发的 RESULT 附带 Worker 端点: 记下 Scheduler 的选择，第一次见到时建立直连
+        endpoint = resp.get('worker_ep')
+        if self.direct and endpoint:
+            self._affinity_worker = resp['worker_id']
+            if resp['worker_id'] not in self._direct_socks:
+                self._open_direct(resp['worker_id'], endpoint, poller)
+
+        with self._pending_lock:
+            slot = self._pending.pop(req_id, None)
+        # 找不到等待者说明请求已超时放弃，直接丢弃
+        if slot is not None:
+            slot.resp = resp
+            slot.event.set()
+
+    def _open_direct(self, worker_id, endpoint, poller):
+        sock = self.context.socket(zmq.DEALER)
+        sock.setsockopt(zmq.LINGER, 0)
+        sock.setsockopt(zmq.IMMEDIATE, 1)
+        sock.setsockopt(zmq.SNDHWM, self.SOCKET_HWM)
+        sock.setsockopt(zmq.RCVHWM, self.SOCKET_HWM)
+        sock.connect(endpoint)
+        poller.register(sock, zmq.POLLIN)
+        self._direct_socks[worker_id] = sock
+
+    def _close_direct(self, worker_id, poller):
+        sock = self._direct_socks.pop(worker_id)
+        poller.unregister(sock)
+        sock.close()
+        self._direct_busy.pop(worker_id, None)
+        if self._affinity_worker == worker_id:
+            self._affinity_worker = None
+
+    def _wait_response(self, req_ids, slots, timeout_ms= 1000 * 1000):
+        """
+        等待 req_ids 全部完成；任一请求失败时在全部完成后抛出。
+        """
+        deadline = time.time() + timeout_ms / 1000
+        errors = []
+        for req_id, slot in zip(req_ids, slots):
+            if not slot.event.wait(max(0, deadline - time.time())):
+                with self._pending_lock:
+                    for rid in req_ids:
+                        self._pending.pop(rid, None)
                 raise TimeoutError(f"Request {req_id} timed out")
 
-    def _manual_cleanup(self, shm_name):
-        try:
-            shm = shared_memory.SharedMemory(name=shm_name)
-            shm.close()
-            shm.unlink()
-        except:
-            pass
\ No newline at end of file
+            if slot.resp['status'] != 'OK':
+                errors.append(slot.resp.get('error'))
+
+        if errors:
+            raise RuntimeError(f"Worker Error: {errors[0]}")
+
+    def _manual_cleanup(self, shm_name, discard=False):
+        # 超时的请求 Worker 可能仍在写入，缓冲区不能再复用；其余情况归还给池
+        if discard:
+            self._pool.discard(shm_name)
+        else:
+            self._pool.release(shm_name)
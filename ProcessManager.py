@@ -1,23 +1,35 @@
+import argparse
 import multiprocessing
 import signal
+import os
 import sys
 import time
 import asyncio
 import traceback
+
+# 本地 cloudvolume 源码只在启动进程中加入一次路径:
+# fork 出的子进程继承 sys.path，spawn 启动的子进程通过 PYTHONPATH 继承
+LOCAL_CLONE = '/CX/neuro_tracking/xinr/cloudvolume_test/Cloudvolume'
+if os.path.exists(LOCAL_CLONE):
+    sys.path.insert(0, LOCAL_CLONE)
+    os.environ['PYTHONPATH'] = os.pathsep.join(filter(None, [LOCAL_CLONE, os.environ.get('PYTHONPATH')]))
+
 from VolumeWorker import VolumeWorker
 from SpatialScheduler import SpatialScheduler
 
 class ProcessManager:
-    def __init__(self, port=5555):
+    def __init__(self, port=5555, pin=True):
         self.bind_addr = f"tcp://127.0.0.1:{port}"
         self.procs = []
+        # pin=True 时 Scheduler 独占第 0 个核，Worker 依次占用后续的 parallel 个核 (超出时回绕)
+        self.pin = pin
 
     def start_scheduler(self):
-        scheduler = SpatialScheduler(self.bind_addr)
+        scheduler = SpatialScheduler(self.bind_addr, pin_cpu=0 if self.pin else None)
         asyncio.run(scheduler.run())
 
-    def start_worker(self, idx, parallel_config):
-        worker = VolumeWorker(self.bind_addr, idx, parallel=parallel_config)
+    def start_worker(self, idx, parallel_config, cpu_start=None):
+        worker = VolumeWorker(self.bind_addr, idx, parallel=parallel_config, cpu_start=cpu_start)
         worker.run()
 
     def start_cluster(self, config_list):
@@ -30,6 +42,7 @@ class ProcessManager:
         time.sleep(1) # 等待 Scheduler bind 端口
         
         worker_idx = 0  # 全局 Worker 编号计数器
+        cpu_cursor = 1  # 下一个 Worker 的起始核 (第 0 个核留给 Scheduler)
 
         for p_level, count in config_list:
             print(f"-> Spawning {count} workers with parallel={p_level}...")
@@ -37,12 +50,13 @@ class ProcessManager:
             for _ in range(count):
                 p_worker = multiprocessing.Process(
                     target=self.start_worker, 
-                    args=(worker_idx, p_level), 
+                    args=(worker_idx, p_level, cpu_cursor if self.pin else None), 
                     name=f"Worker-{worker_idx}-P{p_level}"
                 )
                 p_worker.start()
                 self.procs.append(p_worker)
                 worker_idx += 1
+                cpu_cursor += p_level
         
         print(f"=== Cluster Ready: 1 Scheduler + {worker_idx} Workers ===")
 
@@ -69,8 +83,13 @@ class ProcessManager:
 # 启动入口
 # ==========================================
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CloudVolume cluster launcher")
+    parser.add_argument("--no-pin", action="store_true",
+                        help="不绑定 CPU (容器 / cgroup 受限等环境下交给内核调度)")
+    args = parser.parse_args()
+
     try:
-        manager = ProcessManager(port=5555)
+        manager = ProcessManager(port=5555, pin=not args.no_pin)
         
         # 配置列表: [ [parallel参数, 进程数量], ... ]
         # 示例含义:
@@ -1,131 +1,248 @@
+import os
+import logging
 import utils
+import protocol
 import zmq
 import zmq.asyncio
 import msgpack
-import time
 import asyncio
-from collections import deque, defaultdict
+import numpy as np
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
 
 class SpatialScheduler:
-    def __init__(self, bind_addr, history_len=5):
+    # 高水位: 突发请求时避免因 HWM 丢弃/阻塞
+    SOCKET_HWM = 10000
+    # 内核收发缓冲，突发的小控制帧不必等待对端读取
+    SOCKET_BUF = 4 << 20
+    # 每轮最多连续取出的消息数，避免持续突发时长时间不处理已取出的消息
+    DRAIN_MAX = 1024
+    # 发送均使用 copy=False: 小于 copy_threshold 的帧 pyzmq 仍会直接拷贝，
+    # 大帧 (如合并后的 BATCH_READ) 则零拷贝交给 libzmq；不需要 MessageTracker，track=False
+
+    def __init__(self, bind_addr, history_len=5, strategy='affinity', load_tolerance=2, pin_cpu=None):
+        """
+        strategy:
+          - 'affinity': 进程亲和 (默认)，同一 PID 的请求固定发给同一 Worker 以复用其 LRU 缓存；
+                        该 Worker 负载超过最小负载 + load_tolerance 时改派给负载最小的 Worker
+          - 'round_robin': 严格轮询
+          - 'spatial': 优先选择历史请求与当前 bbox 重叠体积最大的 Worker (Cache Affinity)，
+                       无重叠时按 Morton Code 兜底
+        load_tolerance: 设为 0 表示严格追求绝对空闲；设为 2 表示允许少量排队以换取缓存
+        pin_cpu: 事件循环为单线程，给定时绑定到该核 (允许集合中的序号)，避免被迁移
+        """
+        if pin_cpu is not None:
+            cpus = utils.pin_cpus(pin_cpu)
+            if cpus:
+                print(f"[Scheduler] Pinned to CPU {cpus}")
         self.bind_addr = bind_addr
+        self.strategy = strategy
+        self.load_tolerance = load_tolerance
         self.context = zmq.asyncio.Context()
         self.socket = self.context.socket(zmq.ROUTER)
+        # 同一底层 socket 的同步句柄: 结果转发直接以 DONTWAIT 发送，省去 asyncio Future 的创建与 await；
+        # 只在事件循环线程中使用，与 asyncio socket 不存在并发访问
+        self._sync_socket = zmq.Socket.shadow(self.socket.underlying)
         
         # Worker 管理
-        self.workers = set()  # 存活的 Worker ID 集合
+        # 存活的 Worker: WorkerID -> 在 worker_list 中的下标。worker_list 按注册顺序排列，
+        # 注册为 O(1) 追加，移除时与末尾交换后弹出
+        self.workers = {}
         self.worker_list = []
         self.rr_counter = 0
-        self.worker_history = defaultdict(lambda: deque(maxlen=history_len)) 
-        self.worker_load = defaultdict(int) # 记录每个 Worker 当前积压的任务数
+        # 历史 bbox 环形缓冲: 所有 Worker 堆叠为 (W, H, 6) 的 int64 数组，按注册顺序分配行号，
+        # 重叠体积可以一次向量化算完。空槽位为全 0 (体积为 0) 的 bbox。
+        self.history_len = history_len
+        self.worker_hist = np.zeros((0, history_len, 6), dtype=np.int64)
+        self.hist_rows = {}         # WorkerID -> 行号
+        self.hist_workers = []      # 行号 -> WorkerID
+        self.hist_heads = []        # 行号 -> 下一个写入位置
+        # 只有 spatial 策略会读取历史；其他策略下默认不记录，调试时可用 SCHED_TRACK_HISTORY=1 打开
+        self._track_history = strategy == 'spatial' or os.environ.get('SCHED_TRACK_HISTORY') == '1'
+        # 每个 Worker 当前积压的任务数，与 worker_list 同下标 (前 len(worker_list) 项有效)，
+        # 最小负载用 argmin 在 C 层一次求出；容量不足时倍增
+        self.worker_load = np.zeros(16, dtype=np.int64)
+        self.worker_endpoints = {}  # WorkerID -> 直连端点 (同机部署的 Worker 才有)
+        # Worker 成员版本: 注册 / 移除 Worker 时递增，作为一帧放在转发给 Client 的 RESULT 前面，
+        # Client 据此丢弃可能已失效的直连
+        self._epoch = 0
+        self._epoch_frame = self._epoch.to_bytes(8, 'little')
+        self.legacy_reqs = set()    # 旧版客户端的 req_id (bytes)，RESULT 中需还原为 str
         
-        # [新增] 进程亲和性映射表: PID (str) -> WorkerID (bytes)
+        # 进程亲和性映射表: PID (bytes) -> WorkerID (bytes)
         self.process_map = {} 
         
         self.ready_event = asyncio.Event()
+        # 复用同一个 Packer (pack 后自动 reset)，避免每条消息重新构造编码器
+        self._packer = msgpack.Packer(use_bin_type=True)
+
+        # 预先触发 JIT 编译，避免第一个请求承担编译开销
+        utils.morton_code_3d(0, 0, 0)
 
     async def run(self):
+        self.socket.setsockopt(zmq.LINGER, 0)
+        # 发往已断开的 identity 时抛出 EHOSTUNREACH 而不是静默丢弃，用于发现下线的 Worker
+        self.socket.setsockopt(zmq.ROUTER_MANDATORY, 1)
+        self.socket.setsockopt(zmq.TCP_KEEPALIVE, 1)
+        self.socket.setsockopt(zmq.SNDHWM, self.SOCKET_HWM)
+        self.socket.setsockopt(zmq.RCVHWM, self.SOCKET_HWM)
+        self.socket.setsockopt(zmq.SNDBUF, self.SOCKET_BUF)
+        self.socket.setsockopt(zmq.RCVBUF, self.SOCKET_BUF)
         self.socket.bind(self.bind_addr)
         print(f"[Scheduler] Listening on {self.bind_addr}")
+
+        # 回环地址额外监听 ipc 端点，供同机 Client 绕过 TCP
+        ipc_addr = protocol.local_ipc_endpoint(self.bind_addr)
+        if ipc_addr:
+            self.socket.bind(ipc_addr)
+            print(f"[Scheduler] Listening on {ipc_addr}")
         
         while True:
             # 接收多帧消息: [Identity, Empty, Payload]
-            frames = await self.socket.recv_multipart()
-            identity = frames[0]
-            payload = msgpack.unpackb(frames[-1])
-            
-            msg_type = payload.get('type')
-            
-            if msg_type == 'READY':
-                self._handle_worker_ready(identity)
-            elif msg_type == 'READ':
-                await self._dispatch_request(identity, payload, frames)
-            elif msg_type == 'RESULT':
-                # 注意：Result 返回时 identity 是 WorkerID
-                await self._forward_result(identity, payload)
-            else:
-                print(f"[Scheduler] Unknown message type: {msg_type}")
-
-    def _handle_worker_ready(self, worker_id):
+            batch = [await self.socket.recv_multipart()]
+            # 突发时把队列中已到达的消息一次取完再逐条处理，摊薄每条消息的事件循环调度开销。
+            # NOBLOCK 的 recv 在 zmq.asyncio 中会立即完成 (或抛出 zmq.Again)，不会让出事件循环
+            while len(batch) < self.DRAIN_MAX:
+                try:
+                    batch.append(await self.socket.recv_multipart(zmq.NOBLOCK))
+                except zmq.Again:
+                    break
+
+            for frames in batch:
+                await self._handle_frames(frames)
+
+    async def _handle_frames(self, frames):
+        identity = frames[0]
+
+        # Worker 结果: [WorkerID, ClientID, b"", RESULT]，按路由帧转发，不解包
+        if len(frames) == 4:
+            await self._relay_result(frames)
+            return
+
+        # READ 请求为定长二进制头，原样转发给 Worker，不做解包/重打包
+        if protocol.is_read(frames[-1]):
+            await self._dispatch_request(identity, frames[-1])
+            return
+        if protocol.is_batch(frames[-1]):
+            await self._dispatch_batch(identity, frames[-1])
+            return
+
+        payload = msgpack.unpackb(frames[-1], use_list=False)
+        
+        msg_type = payload.get('type')
+        
+        if msg_type == 'READY':
+            self._handle_worker_ready(identity, payload)
+        elif msg_type == 'RESULT':
+            # 注意：Result 返回时 identity 是 WorkerID
+            await self._forward_result(identity, payload)
+        elif msg_type == 'READ':
+            # 旧版客户端的 msgpack 请求: 入口处转为二进制，Worker 只需处理一种格式
+            msg = protocol.legacy_to_read(payload)
+            if isinstance(payload['req_id'], str):
+                self.legacy_reqs.add(protocol.read_req_id(msg))
+            await self._dispatch_request(identity, msg)
+        elif msg_type == 'DIRECT_START':
+            # Worker 收到 Client 直连的请求: 计入负载，与经由 Scheduler 分配的请求一样参与负载比较
+            idx = self.workers.get(identity)
+            if idx is not None:
+                self.worker_load[idx] += payload['count']
+        elif msg_type == 'DIRECT_DONE':
+            # Client 直连 Worker 完成的请求: 扣除负载并更新历史 (请求无法解析时 bbox 为空)
+            self._release_load(identity)
+            if self._track_history and payload['bbox'] is not None and identity in self.hist_rows:
+                self._record_history(identity, payload['bbox'])
+        else:
+            print(f"[Scheduler] Unknown message type: {msg_type}")
+
+    def _handle_worker_ready(self, worker_id, payload):
         if worker_id not in self.workers:
-            self.workers.add(worker_id)
-            self.worker_load[worker_id] = 0
-            self.worker_list = sorted(list(self.workers))
+            idx = len(self.worker_list)
+            if idx == len(self.worker_load):
+                self.worker_load = np.concatenate([self.worker_load, np.zeros_like(self.worker_load)])
+            self.workers[worker_id] = idx
+            self.worker_list.append(worker_id)
+            self.worker_load[idx] = 0
+            if payload.get('endpoint'):
+                self.worker_endpoints[worker_id] = payload['endpoint']
+            self._add_history_row(worker_id)
+            self._bump_epoch()
             print(f"[Scheduler] Worker registered: {worker_id}")
             self.ready_event.set()
 
-    async def old_dispatch_request(self, client_id, payload, raw_frames):
-        """
-        策略：Process Affinity + Least Load Fallback
-        优先将同一进程的请求发给同一 Worker；如果该 Worker 忙碌，则重新分配给负载最小的 Worker。
-        """
-        time1 = time.time()
+    def _remove_worker(self, worker_id):
+        """移除下线的 Worker: 与 worker_list 末尾交换后弹出，历史数组同样处理"""
+        idx = self.workers.pop(worker_id, None)
+        if idx is None:
+            return
+        last = self.worker_list.pop()
+        if last != worker_id:
+            self.worker_list[idx] = last
+            self.workers[last] = idx
+            self.worker_load[idx] = self.worker_load[len(self.worker_list)]
+        self.worker_endpoints.pop(worker_id, None)
+        self._remove_history_row(worker_id)
+        self._bump_epoch()
         if not self.workers:
-            print("[Scheduler] No workers available! Waiting...")
-            await self.ready_event.wait()
+            self.ready_event.clear()
+        print(f"[Scheduler] Worker removed: {worker_id}")
 
-        # 1. 从 req_id 解析 PID
-        # req_id format: "{pid}_req_{uuid}"
-        req_id = payload.get('req_id', '')
-        try:
-            pid = req_id.split('_')[0]
-        except IndexError:
-            # 如果格式不对，用 client_id 做 fallback
-            pid = client_id
+    def _bump_epoch(self):
+        self._epoch += 1
+        self._epoch_frame = self._epoch.to_bytes(8, 'little')
 
-        # 2. 获取当前集群负载状态
-        min_load = min(self.worker_load[w] for w in self.workers)
-        
-        # [配置] 忙碌阈值：如果目标 Worker 的负载比最闲的 Worker 高出多少，视为"不空闲/忙碌"
-        # 设为 0 表示严格追求绝对空闲；设为 2 表示允许少量排队以换取缓存
-        LOAD_TOLERANCE = 2 
+    def _release_load(self, worker_id):
+        idx = self.workers.get(worker_id)
+        if idx is not None and self.worker_load[idx] > 0:
+            self.worker_load[idx] -= 1
 
-        # 3. 决策最佳 Worker
-        best_worker = None
-        target_worker = self.process_map.get(pid)
-
-        # 逻辑：
-        # A. 如果有绑定的 Worker，且该 Worker 存活，且该 Worker 相对空闲 -> 保持绑定
-        # B. 否则 (新进程 或 原Worker太忙) -> 选负载最小的 -> 更新绑定
-        
-        if target_worker and target_worker in self.workers:
-            target_load = self.worker_load[target_worker]
-            # 判定是否"空闲" (这里定义为: 负载不超过最小负载 + 容忍度)
-            if target_load <= min_load + LOAD_TOLERANCE:
-                best_worker = target_worker
-            else:
-                # 原 Worker 太忙，切换到最闲的 Worker
-                best_worker = min(self.workers, key=lambda w: self.worker_load[w])
-                self.process_map[pid] = best_worker # 更新绑定
-        else:
-            # 新进程 或 原 Worker 已下线
-            best_worker = min(self.workers, key=lambda w: self.worker_load[w])
-            self.process_map[pid] = best_worker # 建立绑定
-
-        # 4. 更新状态
-        bbox = payload['bbox']
-        self.worker_history[best_worker].append(bbox)
-        self.worker_load[best_worker] += 1 
-        
-        # 转发
-        payload['client_id'] = client_id
-        
-        # 调试日志
-        # status = "Affinity" if best_worker == target_worker else "Rebalance"
-        # print(f"[Sched] {pid} -> {best_worker} ({status}, Load: {self.worker_load[best_worker]})")
-        
-        new_msg = [best_worker, b"", msgpack.packb(payload)]
-        await self.socket.send_multipart(new_msg)
+    async def _relay_result(self, frames):
+        """
+        Worker 把 client_id 作为路由帧原样带回，去掉 WorkerID 帧、在 RESULT 前插入成员版本后转发给 Client，并减少 Worker 负载。
+        直连端点由 Worker 自己写入 RESULT；只有存在旧版客户端的请求时才需要解包还原 req_id。
+        """
+        self._release_load(frames[0])
+        out = [frames[1], b"", self._epoch_frame, frames[-1]]
+        if self.legacy_reqs:
+            payload = msgpack.unpackb(out[-1], use_list=False)
+            if payload['req_id'] in self.legacy_reqs:
+                self.legacy_reqs.discard(payload['req_id'])
+                payload['req_id'] = payload['req_id'].decode()
+                out[-1] = self._packer.pack(payload)
+        await self._send_to_client(out)
 
     async def _forward_result(self, worker_id, payload):
         """
-        收到 Worker 结果，转发回 Client，并减少 Worker 负载
+        单帧 msgpack 的 RESULT (client_id 在消息体中，旧版 Worker)：转发回 Client，并减少 Worker 负载
         """
-        if worker_id in self.worker_load:
-            self.worker_load[worker_id] = max(0, self.worker_load[worker_id] - 1)
-            
-        client_id = payload['client_id']
-        await self.socket.send_multipart([client_id, b"", msgpack.packb(payload)])
+        self._release_load(worker_id)
+
+        # 附带 Worker 的直连端点，Client 之后可直接向该 Worker 发送请求
+        endpoint = self.worker_endpoints.get(worker_id)
+        if endpoint:
+            payload['worker_id'] = worker_id
+            payload['worker_ep'] = endpoint
+
+        if self.legacy_reqs and payload['req_id'] in self.legacy_reqs:
+            self.legacy_reqs.discard(payload['req_id'])
+            payload['req_id'] = payload['req_id'].decode()
+
+        await self._send_to_client([payload['client_id'], b"", self._epoch_frame, self._packer.pack(payload)])
+
+    async def _send_to_client(self, frames):
+        """frames[0] 为 ClientID；Client 已退出时丢弃"""
+        try:
+            try:
+                self._sync_socket.send_multipart(frames, zmq.DONTWAIT, copy=False, track=False)
+            except zmq.Again:
+                # Client 的管道已满才退回异步发送，等待可写
+                await self.socket.send_multipart(frames, copy=False, track=False)
+        except zmq.ZMQError as e:
+            if e.errno != zmq.EHOSTUNREACH:
+                raise
+            # Client 已退出，结果无人接收
+            print(f"[Scheduler] Client unreachable, dropping result: {frames[0]}")
 
 
     def _get_round_robin_worker(self):
@@ -146,28 +263,132 @@ class SpatialScheduler:
         
         return worker_id
 
-    # [修改方法] 使用轮询的分发逻辑
-    async def _dispatch_request(self, client_id, payload, raw_frames):
+    async def _dispatch_request(self, client_id, payload):
+        """
+        单条 READ 请求：由 _assign_worker 按配置的策略 (默认亲和，或 spatial / round_robin) 选择 Worker 后转发
+        """
         # 1. 等待 Worker 可用
         if not self.workers:
-            print("[Scheduler] No workers available! Waiting...")
+            logger.debug("[Scheduler] No workers available! Waiting...")
             await self.ready_event.wait()
 
-        # 2. [修改点] 调用轮询方法获取 Worker
-        best_worker = self._get_round_robin_worker()
+        # 2-4. 选择 Worker 并转发: client_id 作为单独一帧放在请求前面，请求体原样透传；
+        # Worker 已下线时移除并重新选择
+        while not await self._send_to_worker(self._assign_worker(payload), client_id, payload):
+            if not self.workers:
+                logger.debug("[Scheduler] No workers available! Waiting...")
+                await self.ready_event.wait()
 
-        # 3. 更新状态 (保持原有逻辑用于统计)
-        bbox = payload.get('bbox')
-        if bbox:
-            self.worker_history[best_worker].append(bbox)
-        
-        self.worker_load[best_worker] += 1 
-        
-        # 4. 转发消息
-        payload['client_id'] = client_id
-        
-        # 调试日志：可以看到分配是严格轮询的
-        # print(f"[Sched] Round-Robin -> {best_worker}")
-        
-        new_msg = [best_worker, b"", msgpack.packb(payload)]
-        await self.socket.send_multipart(new_msg)
\ No newline at end of file
+    async def _dispatch_batch(self, client_id, payload):
+        """
+        批量请求：逐条选择 Worker，发往同一 Worker 的请求再合并为一帧转发
+        """
+        if not self.workers:
+            logger.debug("[Scheduler] No workers available! Waiting...")
+            await self.ready_event.wait()
+
+        groups = defaultdict(list)
+        for msg in protocol.iter_batch(payload):
+            groups[self._assign_worker(msg)].append(msg)
+
+        for worker_id, msgs in groups.items():
+            body = msgs[0] if len(msgs) == 1 else protocol.pack_batch(msgs)
+            if not await self._send_to_worker(worker_id, client_id, body):
+                # 该 Worker 已下线，其中的请求逐条重新分配
+                for msg in msgs:
+                    await self._dispatch_request(client_id, msg)
+
+    async def _send_to_worker(self, worker_id, client_id, body):
+        """发送一帧请求给 Worker；Worker 已断开时将其移除并返回 False"""
+        try:
+            await self.socket.send_multipart([worker_id, b"", client_id, body], copy=False, track=False)
+            return True
+        except zmq.ZMQError as e:
+            if e.errno != zmq.EHOSTUNREACH:
+                raise
+            self._remove_worker(worker_id)
+            return False
+
+    def _assign_worker(self, msg):
+        """为一条 READ 请求选择 Worker，并记录历史与负载"""
+        bbox = protocol.read_bbox(msg)
+        if self.strategy == 'spatial':
+            best_worker = self._get_spatial_worker(bbox)
+        elif self.strategy == 'round_robin':
+            best_worker = self._get_round_robin_worker()
+        else:
+            best_worker = self._get_affinity_worker(msg)
+
+        # 更新状态
+        if self._track_history:
+            self._record_history(best_worker, bbox)
+        self.worker_load[self.workers[best_worker]] += 1
+        return best_worker
+
+    def _get_affinity_worker(self, msg):
+        """
+        策略：Process Affinity + Least Load Fallback
+        优先将同一进程的请求发给同一 Worker；如果该 Worker 忙碌，则重新分配给负载最小的 Worker。
+        """
+        # req_id format: b"{pid}_req_{序号}"
+        pid = protocol.read_req_id(msg).split(b'_', 1)[0]
+        loads = self.worker_load[:len(self.worker_list)]
+        min_idx = int(loads.argmin())
+
+        # A. 有绑定的 Worker，且存活、相对空闲 -> 保持绑定
+        target_idx = self.workers.get(self.process_map.get(pid))
+        if target_idx is not None and loads[target_idx] <= loads[min_idx] + self.load_tolerance:
+            return self.worker_list[target_idx]
+
+        # B. 新进程 / 原 Worker 已下线 / 原 Worker 太忙 -> 选负载最小的并更新绑定
+        best_worker = self.worker_list[min_idx]
+        self.process_map[pid] = best_worker
+        return best_worker
+
+    def _get_spatial_worker(self, bbox):
+        """
+        策略 A: 与历史 bbox 重叠体积之和最大的 Worker (一次向量化计算全部 W x H 个交集)
+        策略 B: 没有任何重叠时，按 bbox 中心的 Morton Code 取模
+        """
+        query = np.asarray(bbox, dtype=np.int64)
+        vols = utils.calc_intersection_volumes(self.worker_hist, query).sum(axis=-1)
+
+        best = int(vols.argmax())
+        if vols[best] > 0:
+            return self.hist_workers[best]
+
+        code = utils.morton_code_3d(
+            (bbox[0] + bbox[3]) // 2,
+            (bbox[1] + bbox[4]) // 2,
+            (bbox[2] + bbox[5]) // 2,
+        )
+        return self.worker_list[code % len(self.worker_list)]
+
+    def _add_history_row(self, worker_id):
+        """新 Worker 注册时为其追加一行历史 (注册很少发生，直接重新分配数组)"""
+        self.hist_rows[worker_id] = len(self.hist_workers)
+        self.hist_workers.append(worker_id)
+        self.hist_heads.append(0)
+        empty = np.zeros((1, self.history_len, 6), dtype=np.int64)
+        self.worker_hist = np.concatenate([self.worker_hist, empty])
+
+    def _remove_history_row(self, worker_id):
+        """删除 Worker 的历史行: 末行移到空出的位置"""
+        row = self.hist_rows.pop(worker_id)
+        last_row = len(self.hist_workers) - 1
+        if row != last_row:
+            moved = self.hist_workers[last_row]
+            self.worker_hist[row] = self.worker_hist[last_row]
+            self.hist_workers[row] = moved
+            self.hist_heads[row] = self.hist_heads[last_row]
+            self.hist_rows[moved] = row
+        self.hist_workers.pop()
+        self.hist_heads.pop()
+        self.worker_hist = self.worker_hist[:last_row].copy()
+
+    def _record_history(self, worker_id, bbox):
+        """把 bbox 写入该 Worker 的环形历史"""
+        row = self.hist_rows[worker_id]
+        head = self.hist_heads[row]
+        self.worker_hist[row, head] = bbox
+        self.hist_heads[row] = (head + 1) % self.history_len
@@ -2,27 +2,93 @@ import zmq
 import msgpack
 import numpy as np
 import traceback
+import logging
 import os
-import sys
 import ctypes
 import time
-from multiprocessing import shared_memory
-from utils import _fast_fill
-
-LOCAL_CLONE = '/CX/neuro_tracking/xinr/cloudvolume_test/Cloudvolume'
-if os.path.exists(LOCAL_CLONE):
-    sys.path.insert(0, LOCAL_CLONE)
+import queue
+import threading
+import protocol
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from shm_utils import attach_shared_memory, shm_exists, prefault
+from utils import fast_fill, fast_fill_batch, calc_intersection_volume, uncovered_regions, pin_cpus
 
 from cloudvolume import CloudVolume
+try:
+    from cloudvolume.lib import Bbox
+except ImportError:
+    Bbox = None
+
+logger = logging.getLogger(__name__)
 
 class VolumeWorker:
-    def __init__(self, scheduler_addr, worker_idx, parallel=4):
+    # 保持打开的共享内存句柄数 (客户端池会复用同名缓冲区)
+    SHM_CACHE_SIZE = 64
+    # 每个缓冲区缓存的 ndarray 视图数 (同一缓冲区可能以不同 shape 复用)
+    VIEWS_PER_SHM = 4
+    # 跳过填充时，超过该大小的缓冲区先预触页，避免 CloudVolume 解压线程逐页缺页
+    PREFAULT_BYTES = 16 << 20
+    # 与 Scheduler 一致的高水位与内核收发缓冲
+    SOCKET_HWM = 10000
+    SOCKET_BUF = 4 << 20
+
+    def __init__(self, scheduler_addr, worker_idx, parallel=4, cpu_start=None, threads=1):
+        """
+        threads > 1 时请求交给线程池处理，主循环在读取期间继续接收下一个请求。
+        CloudVolume 实例 (renderbuffer) 不能跨线程共享，每个线程各用一个实例，LRU 缓存也随之按线程划分。
+        """
         self.scheduler_addr = scheduler_addr
         self.worker_id = f"worker_{worker_idx}_{os.getpid()}".encode('utf-8')
         self.parallel = parallel
+        self.threads = max(1, threads)
+
+        # 绑定到从 cpu_start 开始的 parallel 个核: 解压线程与填充线程继承该掩码，
+        # 进程不被迁移，LRU 缓存与 L2/L3 保持热
+        if cpu_start is not None:
+            cpus = pin_cpus(cpu_start, parallel)
+            if cpus:
+                print(f"[{self.worker_id.decode()}] Pinned to CPUs {cpus}")
         
-        print(f"[{self.worker_id.decode()}] Init CloudVolume (Parallel={parallel})...")
-        self.cv = CloudVolume(
+        print(f"[{self.worker_id.decode()}] Init CloudVolume (Parallel={parallel}, Threads={self.threads})...")
+        self.cv = self._open_volume()
+        # 空闲的 CloudVolume 实例，处理请求时取出、完成后放回
+        self._cv_pool = queue.SimpleQueue()
+        self._cv_pool.put(self.cv)
+        for _ in range(self.threads - 1):
+            self._cv_pool.put(self._open_volume())
+        # 直接以 Bbox 调用 download，跳过 __getitem__ 的切片解析；旧版本没有该接口时退回切片下标
+        self._use_download = Bbox is not None and callable(getattr(self.cv, 'download', None))
+        # 数据集边界 [x1, y1, z1, x2, y2, z2]，用于判断哪些体素需要背景色填充
+        self.bounds = [int(c) for c in self.cv.bounds.to_list()]
+        self.context = zmq.Context()
+        self.socket = self.context.socket(zmq.DEALER)
+        self.socket.identity = self.worker_id
+        # 同机部署时额外监听直连端点，Client 可绕过 Scheduler 直接发送请求
+        self.direct_endpoint = protocol.local_worker_endpoint(scheduler_addr, worker_idx)
+        self.direct_socket = None
+        # 复用同一个 Packer (pack 后自动 reset)，避免每条消息重新构造编码器
+        self._packer = msgpack.Packer(use_bin_type=True)
+        self._shm_cache = OrderedDict()     # shm_name -> (已 attach 的句柄, {(shape, dtype, order): ndarray}) (LRU)
+        self._shm_lock = threading.Lock()
+
+        # 线程池模式: ZMQ socket 只由主循环使用，处理线程通过 inproc PUSH 提交待发送的帧，
+        # 在途请求数以信号量限制为 threads，积压的请求留在 socket 队列中
+        self._send_lock = threading.Lock()
+        self._executor = None
+        self._outbox = None
+        self._outbox_pull = None
+        if self.threads > 1:
+            self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix=self.worker_id.decode())
+            self._slots = threading.BoundedSemaphore(self.threads)
+            outbox_addr = f"inproc://outbox-{self.worker_id.decode()}"
+            self._outbox_pull = self.context.socket(zmq.PULL)
+            self._outbox_pull.bind(outbox_addr)
+            self._outbox = self.context.socket(zmq.PUSH)
+            self._outbox.connect(outbox_addr)
+
+    def _open_volume(self):
+        cv = CloudVolume(
             '/CX/neuro_tracking/fafb-ffn1', 
             mip=0,
             fill_missing=True,
@@ -30,62 +96,162 @@ class VolumeWorker:
             cache=True,
             lru_bytes=80 * 1024**2, 
         )
-        self.cv.cache_thread = 0
-        self.cv.partial_decompress_parallel = parallel
-        self.context = zmq.Context()
-        self.socket = self.context.socket(zmq.DEALER)
-        self.socket.identity = self.worker_id
+        cv.cache_thread = 0
+        cv.partial_decompress_parallel = self.parallel
+        return cv
 
     def run(self):
         try:
-            self.socket.connect(self.scheduler_addr)
-            # 发送 READY 时携带自身的并行能力信息
-            ready_payload = {"type": "READY", "parallel": self.parallel}
-            self.socket.send(msgpack.packb(ready_payload))
-            
+            self.socket.setsockopt(zmq.LINGER, 0)
+            self.socket.setsockopt(zmq.TCP_KEEPALIVE, 1)
+            self.socket.setsockopt(zmq.IMMEDIATE, 1)
+            self.socket.setsockopt(zmq.SNDHWM, self.SOCKET_HWM)
+            self.socket.setsockopt(zmq.RCVHWM, self.SOCKET_HWM)
+            self.socket.setsockopt(zmq.SNDBUF, self.SOCKET_BUF)
+            self.socket.setsockopt(zmq.RCVBUF, self.SOCKET_BUF)
+            # 与 Scheduler 同机时走 ipc，绕过 TCP 协议栈
+            self.socket.connect(protocol.resolve_local_endpoint(self.scheduler_addr))
+            if self.direct_endpoint:
+                self.direct_socket = self.context.socket(zmq.ROUTER)
+                self.direct_socket.setsockopt(zmq.LINGER, 0)
+                self.direct_socket.setsockopt(zmq.SNDHWM, self.SOCKET_HWM)
+                self.direct_socket.setsockopt(zmq.RCVHWM, self.SOCKET_HWM)
+                self.direct_socket.bind(self.direct_endpoint)
+
+            # 发送 READY 时携带自身的并行能力信息与直连端点
+            ready_payload = {"type": "READY", "parallel": self.parallel, "endpoint": self.direct_endpoint}
+            self.socket.send(self._packer.pack(ready_payload))
+
+            poller = zmq.Poller()
+            poller.register(self.socket, zmq.POLLIN)
+            if self.direct_socket is not None:
+                poller.register(self.direct_socket, zmq.POLLIN)
+            if self._outbox_pull is not None:
+                poller.register(self._outbox_pull, zmq.POLLIN)
+
             while True:
-                frames = self.socket.recv_multipart()
-                req = msgpack.unpackb(frames[-1])
-                self._process_request(req)
+                socks = dict(poller.poll())
+                if self._outbox_pull in socks:
+                    self._flush_outbox()
+                # copy=False: 请求体直接以 memoryview 解析，不再拷贝成 bytes
+                if self.socket in socks:
+                    # 帧结构: [b"", client_id, READ / BATCH_READ 请求]
+                    frames = self.socket.recv_multipart(copy=False)
+                    self._handle_message(frames[-2].bytes, frames[-1].buffer, direct=False)
+                if self.direct_socket in socks:
+                    # 直连帧结构: [client 连接标识, READ / BATCH_READ 请求]
+                    peer, msg = self.direct_socket.recv_multipart(copy=False)
+                    self._handle_message(peer.bytes, msg.buffer, direct=True)
         except Exception:
             traceback.print_exc()
 
-    def _process_request(self, req):
-        time1=time.perf_counter()
-        client_id = req['client_id']
-        req_id = req['req_id']
-        shm_name = req['shm_name']
-        shape = req['shape']
-        dtype_str = req['dtype']
-        order = req['order']
-        bbox_list = req['bbox']
-        bg_color = req.get('bg_color', 0) # 获取需要填充的颜色
-        data_size = req['data_size']
+    def _handle_message(self, client_id, msg, direct):
+        if protocol.is_batch(msg):
+            subs = protocol.iter_batch(msg)
+        elif protocol.is_read(msg):
+            subs = (msg,)
+        else:
+            print(f"[{self.worker_id.decode()}] Unknown message tag: {msg[0] if len(msg) else None}")
+            return
+
+        if direct:
+            # 直连请求不经过 Scheduler，先通知它计入本 Worker 的负载 (完成时由 DIRECT_DONE 扣除)，
+            # 否则亲和策略的负载比较会把忙于直连请求的 Worker 当作空闲
+            subs = list(subs)
+            with self._send_lock:
+                self._send_frames(False, [self._packer.pack({"type": "DIRECT_START", "count": len(subs)})])
+
+        for sub in subs:
+            if self._executor is None:
+                self._run_request(client_id, sub, direct)
+                continue
+            # 线程全忙时在这里等待；等待期间先把已完成请求的结果发出去
+            while not self._slots.acquire(timeout=0.001):
+                self._flush_outbox()
+            self._executor.submit(self._run_request, client_id, sub, direct)
+
+    def _run_request(self, client_id, msg, direct):
         try:
+            self._process_request(client_id, msg, direct)
+        except ValueError:
+            # 无法解析的请求 (例如协议版本不符) 没有可回复的 req_id，只能丢弃；直连请求仍需扣除 DIRECT_START 计入的负载
+            traceback.print_exc()
+            if direct:
+                with self._send_lock:
+                    self._send_frames(False, [self._packer.pack({"type": "DIRECT_DONE", "bbox": None})])
+        finally:
+            if self._executor is not None:
+                self._slots.release()
 
-            existing_shm=shared_memory.SharedMemory(create=True, size=int(data_size), name=shm_name)
+    def _flush_outbox(self):
+        """主循环：把处理线程提交的帧发到对应的 socket"""
+        while True:
             try:
-                from multiprocessing import resource_tracker
-                resource_tracker.unregister(existing_shm._name, 'shared_memory')
-            except:
-                pass
+                kind, *frames = self._outbox_pull.recv_multipart(zmq.NOBLOCK)
+            except zmq.Again:
+                return
+            if kind == b"D":
+                self.direct_socket.send_multipart(frames)
+            else:
+                self.socket.send_multipart(frames)
+
+    def _send_frames(self, direct, frames):
+        # 调用方需持有 _send_lock
+        if self._outbox is not None:
+            self._outbox.send_multipart([b"D" if direct else b"S"] + frames)
+        elif direct:
+            self.direct_socket.send_multipart(frames)
+        else:
+            self.socket.send_multipart(frames)
+
+    def _reply(self, client_id, resp, direct, bbox_list):
+        """
+        经由 Scheduler 的请求把结果发回 Scheduler 转发；
+        直连请求直接回复 Client，再通知 Scheduler 扣除负载并更新历史 (不在 Client 的关键路径上)。
+        Packer 与 outbox 不是线程安全的，统一在 _send_lock 下使用。
+        """
+        with self._send_lock:
+            if not direct:
+                # client_id 作为路由帧放在结果前面，Scheduler 无需解包即可转发；
+                # 同时附带直连端点，Client 之后可直接向本 Worker 发送请求
+                if self.direct_endpoint:
+                    resp['worker_id'] = self.worker_id
+                    resp['worker_ep'] = self.direct_endpoint
+                self._send_frames(False, [client_id, b"", self._packer.pack(resp)])
+                return
+            self._send_frames(True, [client_id, self._packer.pack(resp)])
+            self._send_frames(False, [self._packer.pack({"type": "DIRECT_DONE", "bbox": bbox_list})])
+
+    def _process_request(self, client_id, msg, direct=False):
+        time1=time.perf_counter()
+        req_id, bbox_list, shape, shm_name, data_size, bg_color, dtype_str, order, needs_fill = protocol.unpack_read(msg)
+        try:
+
+            # 共享内存由客户端的 ShmPool 创建并复用，句柄缓存后同名缓冲区无需再次 attach
+            with self._shm_lock:
+                shm_entry = self._get_shm(shm_name, data_size)
+            existing_shm = shm_entry[0]
             time2=time.perf_counter()
 
-            _fast_fill(existing_shm.buf, shape, dtype_str, self.parallel, bg_color, order)
+            # 客户端刚创建的缓冲区由内核清零，背景色为 0 时无需再写一遍
+            if needs_fill:
+                self._fill_uncovered(shm_entry, shape, dtype_str, order, bbox_list, bg_color)
+            elif data_size > self.PREFAULT_BYTES:
+                self._prefault(existing_shm, data_size)
             time3=time.perf_counter()
 
-            slices = [
-                slice(bbox_list[0], bbox_list[3]),
-                slice(bbox_list[1], bbox_list[4]),
-                slice(bbox_list[2], bbox_list[5])
-            ]
-            
-            self.cv.renderbuffer = existing_shm.buf
-            self.cv[slices[0], slices[1], slices[2]]
+            cv = self._cv_pool.get()
+            try:
+                cv.renderbuffer = existing_shm.buf
+                if self._use_download:
+                    cv.download(Bbox(bbox_list[:3], bbox_list[3:]), mip=cv.mip)
+                else:
+                    cv[bbox_list[0]:bbox_list[3], bbox_list[1]:bbox_list[4], bbox_list[2]:bbox_list[5]]
+            finally:
+                self._cv_pool.put(cv)
             time4=time.perf_counter()
-            print(f"Prepare time {(time2-time1)*1000}ms, _fast_fill time {(time3-time2)*1000}ms, cv time {(time4-time3)*1000}ms")
-
-            existing_shm.close()
+            logger.debug("Prepare time %.3fms, _fill_uncovered time %.3fms, cv time %.3fms",
+                         (time2 - time1) * 1000, (time3 - time2) * 1000, (time4 - time3) * 1000)
 
             resp = {
                 "type": "RESULT",
@@ -93,7 +259,7 @@ class VolumeWorker:
                 "req_id": req_id,
                 "status": "OK"
             }
-            self.socket.send(msgpack.packb(resp))
+            self._reply(client_id, resp, direct, bbox_list)
 
         except Exception as e:
             err_resp = {
@@ -103,5 +269,86 @@ class VolumeWorker:
                 "status": "ERROR",
                 "error": str(e)
             }
-            self.socket.send(msgpack.packb(err_resp))
+            self._reply(client_id, err_resp, direct, bbox_list)
             traceback.print_exc()
+
+    def _get_shm(self, shm_name, size):
+        """
+        取已 attach 的共享内存句柄 (LRU)。池中的名字不会重复使用，
+        缓存项只会因客户端 unlink 而失效，命中时检查一次文件是否仍在，避免继续占住已释放的内存。
+        """
+        entry = self._shm_cache.get(shm_name)
+        if entry is not None:
+            if entry[0].size >= size and shm_exists(shm_name):
+                self._shm_cache.move_to_end(shm_name)
+                return entry
+            self._close_shm(self._shm_cache.pop(shm_name))
+
+        # 未命中时 attach (不登记 resource_tracker)
+        entry = (attach_shared_memory(shm_name, track=False), {})
+        self._shm_cache[shm_name] = entry
+        while len(self._shm_cache) > self.SHM_CACHE_SIZE:
+            _, old = self._shm_cache.popitem(last=False)
+            self._close_shm(old)
+        return entry
+
+    def _get_view(self, shm_entry, shape, dtype_str, order):
+        """缓冲区上的 ndarray 视图，按 (shape, dtype, order) 缓存，省去每次构造时的 dtype 解析与校验"""
+        shm, views = shm_entry
+        key = (shape, dtype_str, order)
+        arr = views.get(key)
+        if arr is None:
+            if len(views) >= self.VIEWS_PER_SHM:
+                views.clear()
+            arr = views[key] = np.ndarray(shape, dtype=dtype_str, buffer=shm.buf, order=order)
+        return arr
+
+    def _close_shm(self, shm_entry):
+        shm, views = shm_entry
+        # 先释放缓存的视图，否则 close 会因缓冲区仍被导出而失败
+        views.clear()
+        try:
+            shm.close()
+        except BufferError:
+            # 仍有视图引用该缓冲区 (例如 cv.renderbuffer)，留给 GC 回收
+            pass
+
+    def _prefault(self, shm, data_size):
+        """
+        预先建立缓冲区的页表。优先 MADV_POPULATE_WRITE (不占内存带宽)，
+        内核不支持时用 C++ 多线程写 0，把缺页分摊到多个核 (缓冲区本就全 0，内容不变)。
+        """
+        if prefault(shm):
+            return
+        buf = np.frombuffer(shm.buf, dtype=np.uint8, count=data_size)
+        fast_fill(buf, 0, num_threads=self.parallel * 2)
+
+    def _fill_uncovered(self, shm_entry, shape, dtype_str, order, bbox_list, bg_color):
+        """
+        只对数据集边界之外的体素填充背景色。
+        边界内的体素都会被 CloudVolume 写入 (缺失块由 fill_missing 补齐)，无需预先填充。
+        """
+        if calc_intersection_volume(bbox_list, self.bounds) == 0:
+            # 整块都在边界外，走 C++ 并行填充
+            with self._shm_lock:
+                arr = self._get_view(shm_entry, shape, dtype_str, order)
+            fast_fill(arr, bg_color, num_threads=self.parallel)
+            return
+
+        regions = uncovered_regions(bbox_list, self.bounds, order)
+        if not regions:
+            return
+
+        with self._shm_lock:
+            arr = self._get_view(shm_entry, shape, dtype_str, order)
+        contiguous = []
+        for region in regions:
+            view = arr[region]
+            # 连续的整片合并为一次 C++ 批量填充，其余的窄条用 numpy 填充
+            flags = view.flags
+            if flags.c_contiguous or flags.f_contiguous:
+                contiguous.append(view)
+            else:
+                view.fill(bg_color)
+        if contiguous:
+            fast_fill_batch(contiguous, bg_color, num_threads=self.parallel)
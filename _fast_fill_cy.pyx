@@ -0,0 +1,89 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+# fast_fill 分发器的 Cython 版本 (可选)，编译命令:
+# CFLAGS="-I$(python -c 'import numpy; print(numpy.get_include())')" cythonize -i -3 _fast_fill_cy.pyx
+# 不直接链接 libfastfill.so: utils 加载库并选好内核 (AVX-512 / *_nt) 后经 init() 传入函数地址，
+# 因此与纯 Python 版本用的是同一组内核，编译时也不需要库的头文件与路径。
+import numpy as np
+cimport numpy as cnp
+from libc.stdint cimport uint64_t, uintptr_t
+
+cnp.import_array()
+
+ctypedef void (*fill_u8_t)(unsigned char* data, size_t size_bytes, unsigned char value, int num_threads) noexcept nogil
+ctypedef void (*fill_u64_t)(uint64_t* data, size_t num_elements, uint64_t value, int num_threads) noexcept nogil
+
+cdef fill_u8_t _fill_u8 = NULL
+cdef fill_u8_t _fill_u8_nt = NULL
+cdef fill_u64_t _fill_u64 = NULL
+cdef fill_u64_t _fill_u64_nt = NULL
+cdef object _zero_untouched = None
+cdef object _mmap_type = None
+
+
+def init(uintptr_t fill_u8, uintptr_t fill_u64, uintptr_t fill_u8_nt, uintptr_t fill_u64_nt, zero_untouched):
+    """
+    传入 C++ 内核的函数地址 (0 表示不可用；*_nt 不可用时退回普通版本) 与 utils._zero_untouched。
+    fill_u8 不可为 0。
+    """
+    global _fill_u8, _fill_u64, _fill_u8_nt, _fill_u64_nt, _zero_untouched, _mmap_type
+    import mmap
+    _fill_u8 = <fill_u8_t>fill_u8
+    _fill_u64 = <fill_u64_t>fill_u64
+    _fill_u8_nt = <fill_u8_t>fill_u8_nt if fill_u8_nt else _fill_u8
+    _fill_u64_nt = <fill_u64_t>fill_u64_nt if fill_u64_nt else _fill_u64
+    _zero_untouched = zero_untouched
+    _mmap_type = mmap.mmap
+
+
+cdef bint _is_mapped(cnp.ndarray array):
+    """与 utils._is_mapped 相同: base 链末端是否为 mmap 对象"""
+    cdef object base = (<object>array).base
+    while isinstance(base, cnp.ndarray):
+        base = base.base
+    if isinstance(base, memoryview):
+        base = base.obj
+    return isinstance(base, _mmap_type)
+
+
+def fast_fill(cnp.ndarray array, value, int num_threads=4, bint prefault=True):
+    """与 utils.fast_fill 行为一致；直接按 type_num 分发，以 array.data 传指针，调用期间释放 GIL"""
+    cdef bint is_zero = value == 0
+    cdef int type_num = cnp.PyArray_TYPE(array)
+    cdef void* data = cnp.PyArray_DATA(array)
+    cdef size_t nbytes = cnp.PyArray_NBYTES(array)
+    cdef size_t size = cnp.PyArray_SIZE(array)
+    cdef unsigned char byte
+    cdef uint64_t word
+    cdef bint mapped
+    cdef fill_u8_t fill_u8
+    cdef fill_u64_t fill_u64
+
+    if not prefault and is_zero and _zero_untouched(array):
+        return
+
+    if not (cnp.PyArray_IS_C_CONTIGUOUS(array) or cnp.PyArray_IS_F_CONTIGUOUS(array)):
+        print("Warning: Array not contiguous, fallback to numpy")
+        array.fill(value)
+        return
+
+    mapped = _is_mapped(array)
+    fill_u8 = _fill_u8_nt if mapped else _fill_u8
+    fill_u64 = _fill_u64_nt if mapped else _fill_u64
+
+    # 与 _U8_DTYPES / _U64_DTYPES 相同: 1 字节类型，及本机字节序的 64 位整数
+    if is_zero or type_num == cnp.NPY_UINT8 or type_num == cnp.NPY_INT8 or type_num == cnp.NPY_BOOL:
+        byte = 0 if is_zero else <unsigned char>(int(value) & 0xFF)
+        with nogil:
+            fill_u8(<unsigned char*>data, nbytes, byte, num_threads)
+    elif (type_num == cnp.NPY_UINT64 or type_num == cnp.NPY_INT64
+          or type_num == cnp.NPY_ULONGLONG or type_num == cnp.NPY_LONGLONG) and cnp.PyArray_ISNOTSWAPPED(array):
+        if fill_u64 == NULL:
+            array.fill(value) # 没编译新库则回退
+            return
+        word = <uint64_t>(int(value) & 0xFFFFFFFFFFFFFFFF)
+        with nogil:
+            fill_u64(<uint64_t*>data, size, word, num_threads)
+    else:
+        # 目前 C++ 只实现了 u8 和 u64，其他类型回退到 Numpy
+        print(f"warning, fast_fill use numpy.fill()")
+        array.fill(value)
@@ -1,18 +1,350 @@
+#if defined(__x86_64__) || defined(__i386__)
 #include <immintrin.h>
+#define FASTFILL_X86 1
+#endif
 #include <omp.h>
 #include <cstdint>
 #include <cstring>
+#include <cstdio>
 #include <algorithm>
+#include <vector>
 #include <sys/mman.h>
+#include <unistd.h>
+#include <dlfcn.h>
+#include <pthread.h>
+#include <sched.h>
+#include <time.h>
+#ifdef __aarch64__
+#include <arm_neon.h>
+#include <sys/auxv.h>
+#ifdef __ARM_FEATURE_SVE
+#include <arm_sve.h>
+#endif
+#endif
+
+// 大块填充是纯流式写：超过 2 倍 LLC 时使用非临时存储 (_mm256_stream_si256) 绕过各级缓存直写内存，
+// 省去写分配 (RFO) 的读流量，也避免把 Worker 中 CloudVolume 的热数据挤出 L2/L3。
+// 较小的填充结果留在缓存里、随后很可能被读取，仍用普通存储。
+// 两种存储都要求 32 字节对齐，未对齐的头部与不足 32 字节的尾部用标量写，
+// 流式存储的线程结束前 _mm_sfence() 保证写入对其他核可见。
+
+// 使用流式存储的最小字节数 (2 x LLC，取不到 L3 大小时按 32MB 计)
+static size_t stream_threshold() {
+    static size_t threshold = 0;
+    if (threshold == 0) {
+        long llc = sysconf(_SC_LEVEL3_CACHE_SIZE);
+        if (llc <= 0) llc = 32L << 20;
+        threshold = 2 * static_cast<size_t>(llc);
+    }
+    return threshold;
+}
+
+// 多路服务器上 libgomp 的静态划分不关心线程与页面所在的节点，一半线程会跨插槽写远端内存。
+// 大块填充且 libnuma 报告多个节点时: 数组先按页对齐均分给各节点，节点内再均分给分到该节点的线程，
+// 线程在填充期间绑定到该节点。首次写入的页面就近分配 (first-touch)，各插槽的内存控制器并行工作。
+// libnuma 运行时 dlopen (只用来取节点数)，未安装或单节点时保持原来的均分。
+struct NumaApi {
+    int nodes;
+    std::vector<cpu_set_t> node_cpus;   // 各节点的 CPU (/sys/devices/system/node/nodeN/cpulist)，读不到时为空集
+};
+
+// 解析 "0-15,32-47" 格式的 CPU 列表
+static cpu_set_t read_node_cpus(int node) {
+    cpu_set_t set;
+    CPU_ZERO(&set);
+    char path[64];
+    std::snprintf(path, sizeof(path), "/sys/devices/system/node/node%d/cpulist", node);
+    FILE* f = std::fopen(path, "r");
+    if (f == nullptr) return set;
+    int lo, hi;
+    while (std::fscanf(f, "%d", &lo) == 1) {
+        hi = lo;
+        int c = std::fgetc(f);
+        if (c == '-') {
+            if (std::fscanf(f, "%d", &hi) != 1) break;
+            c = std::fgetc(f);
+        }
+        for (int cpu = lo; cpu <= hi && cpu < CPU_SETSIZE; ++cpu) CPU_SET(cpu, &set);
+        if (c != ',') break;
+    }
+    std::fclose(f);
+    return set;
+}
+
+static const NumaApi& numa_api() {
+    static const NumaApi api = [] {
+        NumaApi a{1, {}};
+        void* handle = dlopen("libnuma.so.1", RTLD_NOW | RTLD_LOCAL);
+        if (handle == nullptr) return a;
+        auto available = reinterpret_cast<int (*)()>(dlsym(handle, "numa_available"));
+        auto configured = reinterpret_cast<int (*)()>(dlsym(handle, "numa_num_configured_nodes"));
+        if (available && configured && available() >= 0) {
+            a.nodes = std::max(configured(), 1);
+            for (int node = 0; node < a.nodes; ++node) a.node_cpus.push_back(read_node_cpus(node));
+        }
+        return a;
+    }();
+    return api;
+}
+
+// 填充期间把当前线程限制在 node 的 CPU 中原本允许的那部分 (与当前亲和性取交集)，析构时恢复。
+// 不扩大亲和性: pin_cpus 绑定到互不重叠核上的各 Worker 在填充期间也不会跑到彼此的核上；交集为空时不绑定
+struct NodeBinding {
+    cpu_set_t saved;
+    bool bound = false;
+
+    explicit NodeBinding(int node) {
+        if (node < 0 || pthread_getaffinity_np(pthread_self(), sizeof(saved), &saved) != 0) return;
+        cpu_set_t target;
+        CPU_AND(&target, &saved, &numa_api().node_cpus[node]);
+        if (CPU_COUNT(&target) == 0 || CPU_EQUAL(&target, &saved)) return;
+        bound = pthread_setaffinity_np(pthread_self(), sizeof(target), &target) == 0;
+    }
+    ~NodeBinding() {
+        if (bound) pthread_setaffinity_np(pthread_self(), sizeof(saved), &saved);
+    }
+};
+
+// 大块填充是否按 NUMA 节点划分
+static bool numa_split(size_t size_bytes) {
+    return size_bytes >= stream_threshold() && numa_api().nodes > 1;
+}
+
+// 线程 tid 负责 [start, end) (单位: 元素，elem 为元素字节数)，返回需要绑定的节点 (不绑定为 -1)
+static int thread_range(size_t n, size_t elem, int tid, int nthreads, bool numa, size_t& start, size_t& end) {
+    int nodes = numa ? std::min(numa_api().nodes, nthreads) : 1;
+    if (nodes <= 1) {
+        size_t chunk = n / nthreads;
+        start = tid * chunk;
+        end = (tid == nthreads - 1) ? n : start + chunk;
+        return -1;
+    }
+
+    // 节点 node 分到线程 [first, last)，数组中 [lo, hi) 一段 (边界按 4KB 页对齐)
+    int node = static_cast<int>(static_cast<long>(tid) * nodes / nthreads);
+    int first = static_cast<int>((static_cast<long>(node) * nthreads + nodes - 1) / nodes);
+    int last = static_cast<int>((static_cast<long>(node + 1) * nthreads + nodes - 1) / nodes);
+    size_t page = std::max<size_t>(4096 / elem, 1);
+    size_t lo = node == 0 ? 0 : n / nodes * node / page * page;
+    size_t hi = node == nodes - 1 ? n : n / nodes * (node + 1) / page * page;
+
+    size_t chunk = (hi - lo) / (last - first);
+    start = lo + (tid - first) * chunk;
+    end = (tid == last - 1) ? hi : start + chunk;
+    return node;
+}
+
+#ifdef __AVX2__
+// 写 blocks 个对齐的 32 字节块，4 路展开 (同时在途的流式存储受写合并缓冲数量限制，4 路足以占满)
+template <bool Stream>
+static inline void store_blocks(__m256i* dst, size_t blocks, __m256i v) {
+    size_t i = 0;
+    for (; i + 4 <= blocks; i += 4) {
+        if (Stream) {
+            _mm256_stream_si256(dst + i + 0, v);
+            _mm256_stream_si256(dst + i + 1, v);
+            _mm256_stream_si256(dst + i + 2, v);
+            _mm256_stream_si256(dst + i + 3, v);
+        } else {
+            _mm256_store_si256(dst + i + 0, v);
+            _mm256_store_si256(dst + i + 1, v);
+            _mm256_store_si256(dst + i + 2, v);
+            _mm256_store_si256(dst + i + 3, v);
+        }
+    }
+    for (; i < blocks; ++i) {
+        if (Stream) _mm256_stream_si256(dst + i, v);
+        else _mm256_store_si256(dst + i, v);
+    }
+    if (Stream) _mm_sfence();
+}
+
+// 低 k 个 64 位通道置位的掩码 (k = 0..4)，供 _mm256_maskstore_epi64 处理头尾
+static inline __m256i lane_mask256(size_t k) {
+    static const int64_t table[8] = {-1, -1, -1, -1, 0, 0, 0, 0};
+    return _mm256_loadu_si256(reinterpret_cast<const __m256i*>(table + 4 - k));
+}
+#endif
+
+#ifdef FASTFILL_X86
+// AVX-512 版本: 64 字节存储，每条指令写满一个缓存行。
+// 用 target 属性单独编译，库本身仍以 -mavx2 构建，由 Python 端按 fastfill_has_avx512() 选择
+#define AVX512_TARGET __attribute__((target("avx512f")))
+
+template <bool Stream>
+AVX512_TARGET static inline void store_blocks512(__m512i* dst, size_t blocks, __m512i v) {
+    size_t i = 0;
+    for (; i + 4 <= blocks; i += 4) {
+        if (Stream) {
+            _mm512_stream_si512(dst + i + 0, v);
+            _mm512_stream_si512(dst + i + 1, v);
+            _mm512_stream_si512(dst + i + 2, v);
+            _mm512_stream_si512(dst + i + 3, v);
+        } else {
+            _mm512_store_si512(dst + i + 0, v);
+            _mm512_store_si512(dst + i + 1, v);
+            _mm512_store_si512(dst + i + 2, v);
+            _mm512_store_si512(dst + i + 3, v);
+        }
+    }
+    for (; i < blocks; ++i) {
+        if (Stream) _mm512_stream_si512(dst + i, v);
+        else _mm512_store_si512(dst + i, v);
+    }
+    if (Stream) _mm_sfence();
+}
+#endif
+
+#ifdef __aarch64__
+// AArch64 (Graviton / Ampere / A64FX): NEON 为基线指令集，无需编译选项；
+// 以 -march=armv8.2-a+sve 构建时另编入 SVE 版本，运行时按 getauxval(AT_HWCAP) 确认 CPU 支持后使用。
+// ARM 核会识别连续整行写入并省去写分配，不需要像 x86 那样显式使用流式存储。
+#ifndef HWCAP_SVE
+#define HWCAP_SVE (1 << 22)
+#endif
+
+// dc zva 一次清零的字节数 (DCZID_EL0.BS 为以 4 字节字为单位的 log2)；DZP 位置位表示禁止使用，返回 0
+static size_t zva_block_size() {
+    static const size_t size = [] {
+        uint64_t dczid;
+        asm volatile("mrs %0, dczid_el0" : "=r"(dczid));
+        return (dczid & 16) ? size_t(0) : size_t(4) << (dczid & 15);
+    }();
+    return size;
+}
+
+static bool cpu_has_sve() {
+#ifdef __ARM_FEATURE_SVE
+    static const bool has = (getauxval(AT_HWCAP) & HWCAP_SVE) != 0;
+    return has;
+#else
+    return false;
+#endif
+}
+
+// 以 64 位 value 填充 count 个元素 (ptr 按 8 字节对齐)
+static void arm_fill_u64(uint64_t* ptr, size_t count, uint64_t value) {
+    // 填 0: dc zva 按块直接清零整条缓存行，不读入原内容；头尾不足一块的部分走下面的存储循环
+    size_t zva = value == 0 ? zva_block_size() : 0;
+    if (zva) {
+        size_t zva_elems = zva / sizeof(uint64_t);
+        size_t head = ((zva - (reinterpret_cast<uintptr_t>(ptr) & (zva - 1))) & (zva - 1)) / sizeof(uint64_t);
+        if (count >= head + zva_elems) {
+            for (size_t k = 0; k < head; ++k) ptr[k] = 0;
+            ptr += head;
+            count -= head;
+            size_t blocks = count / zva_elems;
+            for (size_t b = 0; b < blocks; ++b) {
+                asm volatile("dc zva, %0" : : "r"(ptr + b * zva_elems) : "memory");
+            }
+            ptr += blocks * zva_elems;
+            count -= blocks * zva_elems;
+        }
+    }
+
+#ifdef __ARM_FEATURE_SVE
+    if (cpu_has_sve()) {
+        // 向量长度由硬件决定 (A64FX 为 512 位)；尾部用 whilelt 谓词一次写完，无需标量循环
+        svuint64_t v = svdup_n_u64(value);
+        svbool_t all = svptrue_b64();
+        size_t step = svcntd();
+        size_t i = 0;
+        for (; i + 4 * step <= count; i += 4 * step) {
+            svst1_u64(all, ptr + i, v);
+            svst1_u64(all, ptr + i + step, v);
+            svst1_u64(all, ptr + i + 2 * step, v);
+            svst1_u64(all, ptr + i + 3 * step, v);
+        }
+        for (; i < count; i += step) {
+            svst1_u64(svwhilelt_b64_u64(i, count), ptr + i, v);
+        }
+        return;
+    }
+#endif
+
+    // NEON: 每条 16 字节，4 路展开为一条 64 字节缓存行
+    uint64x2_t v = vdupq_n_u64(value);
+    size_t i = 0;
+    for (; i + 8 <= count; i += 8) {
+        vst1q_u64(ptr + i + 0, v);
+        vst1q_u64(ptr + i + 2, v);
+        vst1q_u64(ptr + i + 4, v);
+        vst1q_u64(ptr + i + 6, v);
+    }
+    for (; i < count; ++i) ptr[i] = value;
+}
+#endif
+
+// 批量填充: 一个 OpenMP 并行区内完成多块缓冲区。各缓冲区按 FILL_BATCH_CHUNK 切块，块动态分配给线程，
+// 逐块调用的 ctypes 开销与并行区创建开销只付一次 (适合大量小块，如 Worker 中边界外的多个区域)
+static const size_t FILL_BATCH_CHUNK = 256 * 1024;
+
+#ifdef __AVX2__
+static inline __m256i splat256(unsigned char value) { return _mm256_set1_epi8(value); }
+static inline __m256i splat256(uint64_t value) { return _mm256_set1_epi64x(value); }
+#endif
+
+// 写一个块: Stream 时对齐的 32 字节部分用流式存储 (共享内存中的输出由其他进程读取，不必留在本核缓存)，
+// 头尾不足 32 字节的部分用普通存储；非 AVX2 构建中两者相同
+template <bool Stream, typename T>
+static inline void fill_chunk(T* ptr, size_t len, T value) {
+#ifdef __AVX2__
+    if (Stream) {
+        size_t head = std::min(((32 - (reinterpret_cast<uintptr_t>(ptr) & 31)) & 31) / sizeof(T), len);
+        std::fill_n(ptr, head, value);
+        ptr += head;
+        len -= head;
+        size_t blocks = len * sizeof(T) / 32;
+        store_blocks<true>(reinterpret_cast<__m256i*>(ptr), blocks, splat256(value));
+        size_t done = blocks * 32 / sizeof(T);
+        std::fill_n(ptr + done, len - done, value);
+        return;
+    }
+#endif
+    std::fill_n(ptr, len, value);
+}
+
+template <bool Stream, typename T>
+static void fill_batch(T** ptrs, const size_t* counts, const T* values, int n_arrays, int num_threads) {
+    const size_t chunk_elems = FILL_BATCH_CHUNK / sizeof(T);
+    // first_chunk[a]: 第 a 块缓冲区的第一个块在全局块序列中的编号
+    std::vector<size_t> first_chunk(n_arrays + 1, 0);
+    for (int a = 0; a < n_arrays; ++a) {
+        first_chunk[a + 1] = first_chunk[a] + (counts[a] + chunk_elems - 1) / chunk_elems;
+    }
+    const size_t total = first_chunk[n_arrays];
+
+    omp_set_num_threads(num_threads);
+    #pragma omp parallel for schedule(dynamic, 1) if(total > 1)
+    for (size_t c = 0; c < total; ++c) {
+        // 空缓冲区不占块号，upper_bound 落在最后一个起点 <= c 的缓冲区
+        size_t a = std::upper_bound(first_chunk.begin(), first_chunk.end(), c) - first_chunk.begin() - 1;
+        size_t start = (c - first_chunk[a]) * chunk_elems;
+        size_t len = std::min(chunk_elems, counts[a] - start);
+        fill_chunk<Stream>(ptrs[a] + start, len, values[a]);
+    }
+}
+
+// 基准测试用计时循环 (见文件末尾的 *_loop 入口)
+template <typename T>
+static double time_fill(void (*fill)(T*, size_t, T, int), T* data, size_t n, T value, int num_threads, int n_iter) {
+    if (n_iter < 1) n_iter = 1;
+    timespec t0, t1;
+    clock_gettime(CLOCK_MONOTONIC, &t0);
+    for (int it = 0; it < n_iter; ++it) fill(data, n, value, num_threads);
+    clock_gettime(CLOCK_MONOTONIC, &t1);
+    return ((t1.tv_sec - t0.tv_sec) + (t1.tv_nsec - t0.tv_nsec) * 1e-9) / n_iter;
+}
 
 extern "C" {
 
 //g++ -O3 -mavx2 -fopenmp -fPIC -shared fast_fill.cpp -o libfastfill.so
+// AArch64: g++ -O3 -fopenmp -fPIC -shared fast_fill.cpp -o libfastfill.so (SVE 机器加 -march=armv8.2-a+sve)
 
 // ==========================================
 //  Uint8 填充 (原有逻辑)
 // ==========================================
-void parallel_fill_u8(unsigned char* data, size_t size_bytes, unsigned char value, int num_threads) {
+static void fill_u8(unsigned char* data, size_t size_bytes, unsigned char value, int num_threads, bool force_stream) {
     // 开启大页建议
     madvise(data, size_bytes, MADV_HUGEPAGE);
 
@@ -21,20 +353,23 @@ void parallel_fill_u8(unsigned char* data, size_t size_bytes, unsigned char valu
         return;
     }
 
+#ifdef __AVX2__
     __m256i v = _mm256_set1_epi8(value);
+    bool stream = force_stream || size_bytes >= stream_threshold();
+#endif
+    bool numa = numa_split(size_bytes);
     omp_set_num_threads(num_threads);
 
     #pragma omp parallel
     {
-        int tid = omp_get_thread_num();
-        int nthreads = omp_get_num_threads();
-        size_t chunk_size = size_bytes / nthreads;
-        size_t start_idx = tid * chunk_size;
-        size_t end_idx = (tid == nthreads - 1) ? size_bytes : start_idx + chunk_size;
+        size_t start_idx, end_idx;
+        NodeBinding binding(thread_range(size_bytes, 1, omp_get_thread_num(), omp_get_num_threads(), numa,
+                                         start_idx, end_idx));
         
         unsigned char* ptr = data + start_idx;
         size_t len = end_idx - start_idx;
 
+#ifdef __AVX2__
         // 32字节对齐处理
         size_t align_offset = (32 - (reinterpret_cast<uintptr_t>(ptr) & 31)) & 31;
         align_offset = std::min(align_offset, len);
@@ -44,79 +379,72 @@ void parallel_fill_u8(unsigned char* data, size_t size_bytes, unsigned char valu
             len -= align_offset;
         }
 
-        // 核心循环
+        // 核心循环 (不预取：目标地址只写不读)
         size_t block32_cnt = len / 32;
-        size_t i = 0;
-        // 预取距离
-        const int PREFETCH_DIST = 256; 
-
-        for (; i + 4 <= block32_cnt; i += 4) {
-            _mm_prefetch(reinterpret_cast<const char*>(ptr + i * 32 + PREFETCH_DIST), _MM_HINT_T0);
-            _mm256_store_si256(reinterpret_cast<__m256i*>(ptr + (i + 0) * 32), v);
-            _mm256_store_si256(reinterpret_cast<__m256i*>(ptr + (i + 1) * 32), v);
-            _mm256_store_si256(reinterpret_cast<__m256i*>(ptr + (i + 2) * 32), v);
-            _mm256_store_si256(reinterpret_cast<__m256i*>(ptr + (i + 3) * 32), v);
-        }
-        for (; i < block32_cnt; ++i) {
-            _mm256_store_si256(reinterpret_cast<__m256i*>(ptr + i * 32), v);
-        }
+        if (stream) store_blocks<true>(reinterpret_cast<__m256i*>(ptr), block32_cnt, v);
+        else store_blocks<false>(reinterpret_cast<__m256i*>(ptr), block32_cnt, v);
+
         size_t tail = len % 32;
         if (tail > 0) std::memset(ptr + block32_cnt * 32, value, tail);
+#elif defined(__aarch64__)
+        // 8 字节对齐后按 64 位图样写，不足 8 字节的尾部用 memset
+        size_t align_offset = std::min((8 - (reinterpret_cast<uintptr_t>(ptr) & 7)) & 7, len);
+        std::memset(ptr, value, align_offset);
+        ptr += align_offset;
+        len -= align_offset;
+        arm_fill_u64(reinterpret_cast<uint64_t*>(ptr), len / 8, 0x0101010101010101ULL * value);
+        std::memset(ptr + len / 8 * 8, value, len % 8);
+#else
+        std::memset(ptr, value, len);
+#endif
     }
 }
 
 // ==========================================
 //  Uint64 填充 (新增逻辑)
 // ==========================================
-void parallel_fill_u64(uint64_t* data, size_t num_elements, uint64_t value, int num_threads) {
+static void fill_u64(uint64_t* data, size_t num_elements, uint64_t value, int num_threads, bool force_stream) {
     size_t size_bytes = num_elements * sizeof(uint64_t);
     madvise(data, size_bytes, MADV_HUGEPAGE);
 
+#ifdef __AVX2__
     // 设置 AVX2 寄存器 (4个 64位整数)
     __m256i v = _mm256_set1_epi64x(value);
+    bool stream = force_stream || size_bytes >= stream_threshold();
+#endif
     
+    bool numa = numa_split(size_bytes);
     omp_set_num_threads(num_threads);
 
     #pragma omp parallel
     {
-        int tid = omp_get_thread_num();
-        int nthreads = omp_get_num_threads();
-
-        size_t chunk_elems = num_elements / nthreads;
-        size_t start_idx = tid * chunk_elems;
-        size_t end_idx = (tid == nthreads - 1) ? num_elements : start_idx + chunk_elems;
+        size_t start_idx, end_idx;
+        NodeBinding binding(thread_range(num_elements, sizeof(uint64_t), omp_get_thread_num(), omp_get_num_threads(),
+                                         numa, start_idx, end_idx));
 
         uint64_t* ptr = data + start_idx;
         size_t count = end_idx - start_idx;
 
+        size_t i = 0;
+#ifdef __AVX2__
         // 对齐处理 (AVX2 需要 32 字节对齐，即 4 个 uint64)
-        // 检查当前地址是否 32 字节对齐
+        // 头部不足 32 字节的元素与尾部余数各用一条掩码存储写完 (0 个元素时掩码全 0，不写内存)，没有标量循环
         size_t align_bytes = (32 - (reinterpret_cast<uintptr_t>(ptr) & 31)) & 31;
-        size_t align_elems = align_bytes / sizeof(uint64_t);
-        
-        if (align_elems > 0 && count >= align_elems) {
-            for (size_t k = 0; k < align_elems; ++k) ptr[k] = value;
-            ptr += align_elems;
-            count -= align_elems;
-        }
+        size_t align_elems = std::min(align_bytes / sizeof(uint64_t), count);
+        _mm256_maskstore_epi64(reinterpret_cast<long long*>(ptr), lane_mask256(align_elems), v);
+        ptr += align_elems;
+        count -= align_elems;
 
-        // 主循环：每次处理 4 个 __m256i，即 16 个 uint64 (128 字节)
-        size_t i = 0;
-        const int PREFETCH_DIST_BYTES = 256;
-
-        for (; i + 16 <= count; i += 16) {
-            _mm_prefetch(reinterpret_cast<const char*>(ptr + i + (PREFETCH_DIST_BYTES/8)), _MM_HINT_T0);
-            
-            _mm256_store_si256(reinterpret_cast<__m256i*>(ptr + i + 0), v);  // 4 elems
-            _mm256_store_si256(reinterpret_cast<__m256i*>(ptr + i + 4), v);
-            _mm256_store_si256(reinterpret_cast<__m256i*>(ptr + i + 8), v);
-            _mm256_store_si256(reinterpret_cast<__m256i*>(ptr + i + 12), v);
-        }
-        
-        // 处理剩余的 4 元素块 (32字节)
-        for (; i + 4 <= count; i += 4) {
-            _mm256_store_si256(reinterpret_cast<__m256i*>(ptr + i), v);
-        }
+        // 主循环：每个 __m256i 为 4 个 uint64 (32 字节)，不预取
+        size_t blocks = count / 4;
+        if (stream) store_blocks<true>(reinterpret_cast<__m256i*>(ptr), blocks, v);
+        else store_blocks<false>(reinterpret_cast<__m256i*>(ptr), blocks, v);
+        _mm256_maskstore_epi64(reinterpret_cast<long long*>(ptr + blocks * 4), lane_mask256(count % 4), v);
+        i = count;
+#elif defined(__aarch64__)
+        arm_fill_u64(ptr, count, value);
+        i = count;
+#endif
 
         // 处理尾部 (Standard Store)
         for (; i < count; ++i) {
@@ -125,4 +453,197 @@ void parallel_fill_u64(uint64_t* data, size_t num_elements, uint64_t value, int
     }
 }
 
-}
\ No newline at end of file
+// ==========================================
+//  AVX-512 版本 (接口与上面相同)
+// ==========================================
+int fastfill_has_avx512() {
+#ifdef FASTFILL_X86
+    return __builtin_cpu_supports("avx512f") ? 1 : 0;
+#else
+    return 0;
+#endif
+}
+
+#ifdef FASTFILL_X86
+
+AVX512_TARGET static void fill_u8_avx512(unsigned char* data, size_t size_bytes, unsigned char value, int num_threads,
+                                         bool force_stream) {
+    madvise(data, size_bytes, MADV_HUGEPAGE);
+
+    if (size_bytes < 2 * 1024 * 1024) {
+        std::memset(data, value, size_bytes);
+        return;
+    }
+
+    // 字节广播为 64 位再展开，只需 AVX512F (_mm512_set1_epi8 属于 AVX512BW)
+    uint64_t pattern = 0x0101010101010101ULL * value;
+    bool stream = force_stream || size_bytes >= stream_threshold();
+    bool numa = numa_split(size_bytes);
+    omp_set_num_threads(num_threads);
+
+    #pragma omp parallel
+    {
+        size_t start_idx, end_idx;
+        NodeBinding binding(thread_range(size_bytes, 1, omp_get_thread_num(), omp_get_num_threads(), numa,
+                                         start_idx, end_idx));
+
+        unsigned char* ptr = data + start_idx;
+        size_t len = end_idx - start_idx;
+        __m512i v = _mm512_set1_epi64(pattern);
+
+        // 64 字节对齐处理
+        size_t align_offset = (64 - (reinterpret_cast<uintptr_t>(ptr) & 63)) & 63;
+        align_offset = std::min(align_offset, len);
+        if (align_offset > 0) {
+            std::memset(ptr, value, align_offset);
+            ptr += align_offset;
+            len -= align_offset;
+        }
+
+        size_t block64_cnt = len / 64;
+        if (stream) store_blocks512<true>(reinterpret_cast<__m512i*>(ptr), block64_cnt, v);
+        else store_blocks512<false>(reinterpret_cast<__m512i*>(ptr), block64_cnt, v);
+
+        size_t tail = len % 64;
+        if (tail > 0) std::memset(ptr + block64_cnt * 64, value, tail);
+    }
+}
+
+AVX512_TARGET static void fill_u64_avx512(uint64_t* data, size_t num_elements, uint64_t value, int num_threads,
+                                          bool force_stream) {
+    size_t size_bytes = num_elements * sizeof(uint64_t);
+    madvise(data, size_bytes, MADV_HUGEPAGE);
+
+    bool stream = force_stream || size_bytes >= stream_threshold();
+    bool numa = numa_split(size_bytes);
+    omp_set_num_threads(num_threads);
+
+    #pragma omp parallel
+    {
+        size_t start_idx, end_idx;
+        NodeBinding binding(thread_range(num_elements, sizeof(uint64_t), omp_get_thread_num(), omp_get_num_threads(),
+                                         numa, start_idx, end_idx));
+
+        uint64_t* ptr = data + start_idx;
+        size_t count = end_idx - start_idx;
+        __m512i v = _mm512_set1_epi64(value);
+
+        // 64 字节对齐，即 8 个 uint64；头部与尾部各用一条掩码存储 (__mmask8 取低 k 位)
+        size_t align_elems = ((64 - (reinterpret_cast<uintptr_t>(ptr) & 63)) & 63) / sizeof(uint64_t);
+        align_elems = std::min(align_elems, count);
+        _mm512_mask_storeu_epi64(ptr, static_cast<__mmask8>((1u << align_elems) - 1), v);
+        ptr += align_elems;
+        count -= align_elems;
+
+        size_t blocks = count / 8;
+        if (stream) store_blocks512<true>(reinterpret_cast<__m512i*>(ptr), blocks, v);
+        else store_blocks512<false>(reinterpret_cast<__m512i*>(ptr), blocks, v);
+        _mm512_mask_storeu_epi64(ptr + blocks * 8, static_cast<__mmask8>((1u << (count % 8)) - 1), v);
+    }
+}
+
+#endif
+
+// ==========================================
+//  对外入口。*_nt 版本不论大小都用流式存储 (不足 2MB 的 u8 填充仍走 memset)：
+//  填充共享内存后由其他进程读取时，数据直接写回内存、不留在本核缓存里，
+//  读方不必经缓存一致性协议从写方的 L2/L3 (多路时跨插槽) 取回各缓存行，可获得更高的读带宽。
+//  非 x86 构建中 *_nt 与普通版本相同。
+// ==========================================
+void parallel_fill_u8(unsigned char* data, size_t size_bytes, unsigned char value, int num_threads) {
+    fill_u8(data, size_bytes, value, num_threads, false);
+}
+
+void parallel_fill_u8_nt(unsigned char* data, size_t size_bytes, unsigned char value, int num_threads) {
+    fill_u8(data, size_bytes, value, num_threads, true);
+}
+
+void parallel_fill_u64(uint64_t* data, size_t num_elements, uint64_t value, int num_threads) {
+    fill_u64(data, num_elements, value, num_threads, false);
+}
+
+void parallel_fill_u64_nt(uint64_t* data, size_t num_elements, uint64_t value, int num_threads) {
+    fill_u64(data, num_elements, value, num_threads, true);
+}
+
+#ifdef FASTFILL_X86
+void parallel_fill_u8_avx512(unsigned char* data, size_t size_bytes, unsigned char value, int num_threads) {
+    fill_u8_avx512(data, size_bytes, value, num_threads, false);
+}
+
+void parallel_fill_u8_nt_avx512(unsigned char* data, size_t size_bytes, unsigned char value, int num_threads) {
+    fill_u8_avx512(data, size_bytes, value, num_threads, true);
+}
+
+void parallel_fill_u64_avx512(uint64_t* data, size_t num_elements, uint64_t value, int num_threads) {
+    fill_u64_avx512(data, num_elements, value, num_threads, false);
+}
+
+void parallel_fill_u64_nt_avx512(uint64_t* data, size_t num_elements, uint64_t value, int num_threads) {
+    fill_u64_avx512(data, num_elements, value, num_threads, true);
+}
+#endif
+
+// ==========================================
+//  批量填充 (第 i 块缓冲区 ptrs[i]，长度 counts[i]，填充值 values[i])
+//  *_nt 为强制流式存储的版本 (填充共享内存用)
+// ==========================================
+void parallel_fill_u8_batch(unsigned char** ptrs, const size_t* sizes_bytes, const unsigned char* values, int n_arrays, int num_threads) {
+    fill_batch<false>(ptrs, sizes_bytes, values, n_arrays, num_threads);
+}
+
+void parallel_fill_u64_batch(uint64_t** ptrs, const size_t* num_elements, const uint64_t* values, int n_arrays, int num_threads) {
+    fill_batch<false>(ptrs, num_elements, values, n_arrays, num_threads);
+}
+
+void parallel_fill_u8_nt_batch(unsigned char** ptrs, const size_t* sizes_bytes, const unsigned char* values, int n_arrays, int num_threads) {
+    fill_batch<true>(ptrs, sizes_bytes, values, n_arrays, num_threads);
+}
+
+void parallel_fill_u64_nt_batch(uint64_t** ptrs, const size_t* num_elements, const uint64_t* values, int n_arrays, int num_threads) {
+    fill_batch<true>(ptrs, num_elements, values, n_arrays, num_threads);
+}
+
+// ==========================================
+//  基准测试用: 在 C 层连续填充 n_iter 次，返回单次平均耗时 (秒)
+//  计时不含 Python 调用与 ctypes 参数转换的开销，按 fastfill_has_avx512() 选用与 utils 相同的内核
+// ==========================================
+double parallel_fill_u8_loop(unsigned char* data, size_t size_bytes, unsigned char value, int num_threads, int n_iter) {
+    void (*fill)(unsigned char*, size_t, unsigned char, int) = parallel_fill_u8;
+#ifdef FASTFILL_X86
+    if (fastfill_has_avx512()) fill = parallel_fill_u8_avx512;
+#endif
+    return time_fill(fill, data, size_bytes, value, num_threads, n_iter);
+}
+
+double parallel_fill_u64_loop(uint64_t* data, size_t num_elements, uint64_t value, int num_threads, int n_iter) {
+    void (*fill)(uint64_t*, size_t, uint64_t, int) = parallel_fill_u64;
+#ifdef FASTFILL_X86
+    if (fastfill_has_avx512()) fill = parallel_fill_u64_avx512;
+#endif
+    return time_fill(fill, data, num_elements, value, num_threads, n_iter);
+}
+
+// ==========================================
+//  BBox 相交体积: out[i] = |a[i] ∩ b[i]| (每个 bbox 为 [x1, y1, z1, x2, y2, z2] 共 6 个 int64)
+//  b_step 为 b 中相邻 bbox 的间隔 (6 为逐对计算，0 为 n 个 bbox 对同一个查询 bbox)。
+//  max / min / 相减 / 截 0 / 连乘融合在一个循环里，不产生 NumPy 版本的中间数组；
+//  n 较小时 (调度器的 W x H 个历史 bbox) 不开并行区，只做 SIMD
+// ==========================================
+void intersection_volumes_i64(const int64_t* a, const int64_t* b, size_t b_step, int64_t* out, size_t n,
+                              int num_threads) {
+    #pragma omp parallel for simd num_threads(num_threads) if(n >= 65536 && num_threads > 1)
+    for (size_t i = 0; i < n; ++i) {
+        const int64_t* p = a + 6 * i;
+        const int64_t* q = b + b_step * i;
+        int64_t dx = std::min(p[3], q[3]) - std::max(p[0], q[0]);
+        int64_t dy = std::min(p[4], q[4]) - std::max(p[1], q[1]);
+        int64_t dz = std::min(p[5], q[5]) - std::max(p[2], q[2]);
+        dx = dx > 0 ? dx : 0;
+        dy = dy > 0 ? dy : 0;
+        dz = dz > 0 ? dz : 0;
+        out[i] = dx * dy * dz;
+    }
+}
+
+}
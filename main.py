@@ -1,13 +1,14 @@
-from ClientProxy import ClientProxy
 import traceback
 import time, random
 import numpy as np
 LOCAL_CLONE = '/CX/neuro_tracking/xinr/cloudvolume_test/Cloudvolume'
 import os
 import sys
+# 只在入口脚本设置一次，需在导入任何依赖 cloudvolume 的模块之前
 if os.path.exists(LOCAL_CLONE):
     sys.path.insert(0, LOCAL_CLONE)
 
+from ClientProxy import ClientProxy
 from cloudvolume import CloudVolume
 from cloudvolume.lib import Bbox 
 
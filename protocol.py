@@ -0,0 +1,172 @@
+import os
+import struct
+
+# =============================================================================
+# 请求协议 (Client -> Scheduler -> Worker)
+# =============================================================================
+# 首字节为消息类型标记。msgpack 编码的 dict 首字节为 0x80-0x8f / 0xde / 0xdf，
+# 因此二进制消息与 msgpack 消息 (READY / RESULT / 旧版 READ) 可以共用同一个 socket 并直接区分。
+MSG_READ = 0x01
+MSG_BATCH_READ = 0x02
+
+# 头格式版本号，头布局变化时递增；收到不认识的版本直接拒绝，而不是按错误的偏移解析
+# v2: 增加 needs_fill
+PROTOCOL_VERSION = 2
+
+# READ 请求的定长头:
+# tag(B) | version(B) | bbox(6q) | shape(4q) | data_size(Q) | bg_color(q) | dtype_code(B) | order(c)
+#        | needs_fill(?) | req_id_len(H) | shm_name_len(H)
+# 之后紧跟 req_id 与 shm_name 的字节
+# needs_fill=False 表示缓冲区刚由内核分配 (全 0) 且背景色为 0，Worker 可跳过背景色填充
+READ_HEADER = struct.Struct('<BB6q4qQqBc?HH')
+# 头中的几何信息 (bbox + shape) 为紧跟 tag/version 的一段连续 10 个 int64，可单独解出
+GEOM = struct.Struct('<6q4q')
+GEOM_OFFSET = 2
+_BBOX = struct.Struct('<6q')
+_REQ_ID_LEN = struct.Struct('<H')
+_REQ_ID_LEN_OFFSET = READ_HEADER.size - 2 * _REQ_ID_LEN.size
+
+# BATCH_READ: tag(B) | count(I)，之后是 count 条 [len(I) | READ 请求]
+BATCH_HEADER = struct.Struct('<BI')
+BATCH_ITEM = struct.Struct('<I')
+
+# dtype 编码表 (下标即 dtype_code)
+DTYPES = (
+    'uint8', 'uint16', 'uint32', 'uint64',
+    'int8', 'int16', 'int32', 'int64',
+    'float32', 'float64',
+)
+DTYPE_CODES = {name: code for code, name in enumerate(DTYPES)}
+
+
+# =============================================================================
+# 端点约定
+# =============================================================================
+def local_ipc_endpoint(addr):
+    """
+    本机回环 TCP 地址对应的 ipc 端点 (tcp://127.x.x.x:PORT -> ipc:///tmp/cv_sched_PORT.sock)；
+    其他地址返回 None。Scheduler 会同时监听该端点，同机 Client 可绕过 TCP 协议栈。
+    """
+    if not addr.startswith("tcp://127."):
+        return None
+    port = addr.rsplit(':', 1)[-1]
+    return f"ipc:///tmp/cv_sched_{port}.sock"
+
+
+def resolve_local_endpoint(addr):
+    """Scheduler 在本机且 ipc 端点已存在 (Scheduler 已启动) 时改走 ipc://，否则原样返回"""
+    ipc_addr = local_ipc_endpoint(addr)
+    if ipc_addr and os.path.exists(ipc_addr[len("ipc://"):]):
+        return ipc_addr
+    return addr
+
+
+def local_worker_endpoint(scheduler_addr, worker_idx):
+    """
+    Scheduler 在本机时 Worker 的直连端点 (ipc:///tmp/cv_worker_PORT_IDX.sock)；否则返回 None。
+    Client 从 RESULT 中获知该端点后，后续请求可直接发给 Worker，省去经由 Scheduler 的两跳。
+    """
+    if not scheduler_addr.startswith("tcp://127."):
+        return None
+    port = scheduler_addr.rsplit(':', 1)[-1]
+    return f"ipc:///tmp/cv_worker_{port}_{worker_idx}.sock"
+
+
+def is_read(msg):
+    """判断一帧是否为二进制 READ 请求"""
+    return len(msg) > 0 and msg[0] == MSG_READ
+
+
+def pack_read(req_id, bbox, shape, shm_name, data_size, bg_color, dtype_code, order, needs_fill=True):
+    """
+    打包 READ 请求。
+    req_id / shm_name 为 bytes，bbox 为 6 个整数，shape 为 4 个整数 (x, y, z, channel)，
+    order 为 b'F' 或 b'C'。
+    """
+    header = READ_HEADER.pack(
+        MSG_READ, PROTOCOL_VERSION, *bbox, *shape, data_size, bg_color, dtype_code, order,
+        needs_fill, len(req_id), len(shm_name)
+    )
+    return header + req_id + shm_name
+
+
+def legacy_to_read(payload):
+    """
+    旧版客户端发送的 msgpack READ dict 转为二进制 READ 请求 (Scheduler 入口处兼容)。
+    shape 只有 3 维时按单通道补齐。
+    """
+    shape = list(payload['shape'])
+    if len(shape) == 3:
+        shape.append(1)
+    req_id = payload['req_id']
+    if isinstance(req_id, str):
+        req_id = req_id.encode()
+    return pack_read(
+        req_id, payload['bbox'], shape, payload['shm_name'].encode(),
+        int(payload['data_size']), int(payload.get('bg_color', 0)),
+        DTYPE_CODES[payload['dtype']], payload.get('order', 'F').encode()
+    )
+
+
+def unpack_read(msg):
+    """
+    解析 READ 请求，返回
+    (req_id, bbox, shape, shm_name, data_size, bg_color, dtype_str, order, needs_fill)
+    req_id 保持 bytes，原样放回 RESULT 供客户端匹配
+    """
+    fields = READ_HEADER.unpack_from(msg, 0)
+    if fields[1] != PROTOCOL_VERSION:
+        raise ValueError(f"Unsupported protocol version {fields[1]} (expected {PROTOCOL_VERSION})")
+    bbox = fields[2:8]
+    shape = fields[8:12]
+    data_size, bg_color, dtype_code, order, needs_fill, req_id_len, shm_name_len = fields[12:]
+
+    offset = READ_HEADER.size
+    req_id = bytes(msg[offset:offset + req_id_len])
+    offset += req_id_len
+    shm_name = bytes(msg[offset:offset + shm_name_len]).decode('utf-8')
+
+    return req_id, bbox, shape, shm_name, data_size, bg_color, DTYPES[dtype_code], order.decode(), needs_fill
+
+
+def read_req_id(msg):
+    """只取出 READ 请求中的 req_id (bytes)"""
+    (req_id_len,) = _REQ_ID_LEN.unpack_from(msg, _REQ_ID_LEN_OFFSET)
+    return bytes(msg[READ_HEADER.size:READ_HEADER.size + req_id_len])
+
+
+def read_geom(msg):
+    """只取出 READ 请求中的 (bbox, shape)"""
+    geom = GEOM.unpack_from(msg, GEOM_OFFSET)
+    return geom[:6], geom[6:]
+
+
+def read_bbox(msg):
+    """只取出 READ 请求中的 bbox (调度器用)，不解析头中其余字段"""
+    return _BBOX.unpack_from(msg, GEOM_OFFSET)
+
+
+def is_batch(msg):
+    """判断一帧是否为 BATCH_READ 请求"""
+    return len(msg) > 0 and msg[0] == MSG_BATCH_READ
+
+
+def pack_batch(msgs):
+    """把多条 READ 请求合并为一帧"""
+    parts = [BATCH_HEADER.pack(MSG_BATCH_READ, len(msgs))]
+    for msg in msgs:
+        parts.append(BATCH_ITEM.pack(len(msg)))
+        parts.append(msg)
+    return b"".join(parts)
+
+
+def iter_batch(msg):
+    """逐条取出 BATCH_READ 中的 READ 请求 (memoryview 切片，不拷贝)"""
+    mv = memoryview(msg)
+    _, count = BATCH_HEADER.unpack_from(mv, 0)
+    offset = BATCH_HEADER.size
+    for _ in range(count):
+        (length,) = BATCH_ITEM.unpack_from(mv, offset)
+        offset += BATCH_ITEM.size
+        yield mv[offset:offset + length]
+        offset += length
@@ -1,8 +1,19 @@
 import numpy as np
-import ctypes, os
+import ctypes, os, mmap
 import ctypes.util
 # 编译命令提示:
 # g++ -O3 -mavx2 -fopenmp -shared -fPIC -o libfastfill.so fast_fill.cpp
+# AArch64 去掉 -mavx2 (NEON 为基线)，SVE 机器加 -march=armv8.2-a+sve
+
+# Numba 为可选依赖: 未安装时热点函数以纯 Python 执行
+try:
+    from numba import njit, prange
+except ImportError:
+    print("Warning: numba not found, scheduler helpers will run as pure Python.")
+    njit = None
+
+def _jit(func):
+    return njit(cache=True)(func) if njit is not None else func
 
 lib_path = os.path.abspath("./libfastfill.so")
 _lib = None
@@ -34,18 +45,105 @@ try:
     except AttributeError:
         print("Warning: parallel_fill_u64 not found in .so. Please recompile C++ code.")
 
+    # 批量入口为后加的符号，旧库没有时 fast_fill_batch 逐个调用 fast_fill
+    for _name in ('parallel_fill_u8_batch', 'parallel_fill_u64_batch',
+                  'parallel_fill_u8_nt_batch', 'parallel_fill_u64_nt_batch'):
+        if hasattr(_lib, _name):
+            _kernel = getattr(_lib, _name)
+            _kernel.argtypes = [
+                ctypes.c_void_p,   # 指针数组 (uintp)
+                ctypes.c_void_p,   # 长度数组: u8 为字节数，u64 为元素个数 (uintp)
+                ctypes.c_void_p,   # 填充值数组 (uint8 / uint64)
+                ctypes.c_int,      # 数组个数
+                ctypes.c_int       # num threads
+            ]
+            _kernel.restype = None
+
+    if hasattr(_lib, 'intersection_volumes_i64'):
+        _lib.intersection_volumes_i64.argtypes = [
+            ctypes.c_void_p,   # a: (n, 6) int64
+            ctypes.c_void_p,   # b: (n, 6) 或 (6,) int64
+            ctypes.c_size_t,   # b 中相邻 bbox 的间隔 (6 或 0)
+            ctypes.c_void_p,   # out: (n,) int64
+            ctypes.c_size_t,   # n
+            ctypes.c_int       # num threads
+        ]
+        _lib.intersection_volumes_i64.restype = None
+
 except OSError:
     print(f"Warning: Could not load {lib_path}, fast fill will not be available.")
     _lib = None
 
-def calc_intersection_volume(bbox_a, bbox_b):
+# CPU 支持 AVX-512 时改用 *_avx512 版本 (64 字节存储)，旧库没有这些符号时保持 AVX2
+_kernel_suffix = ''
+if _lib is not None and hasattr(_lib, 'fastfill_has_avx512') and _lib.fastfill_has_avx512():
+    _kernel_suffix = '_avx512'
+    for _name in ('parallel_fill_u8', 'parallel_fill_u64'):
+        _kernel = getattr(_lib, _name + _kernel_suffix)
+        _kernel.argtypes = getattr(_lib, _name).argtypes
+        _kernel.restype = None
+
+# 调用入口: 安装了 cffi 时走 ABI 模式 (数组经缓冲协议直接传指针，参数转换在 C 层完成)，
+# 否则用 ctypes (每次调用都要经 array.ctypes 取地址、构造 c_uint64)
+# *_nt 为强制流式存储的版本 (填充共享内存用)，旧库没有这些符号时为 None，共享内存也走普通版本
+_KERNELS = ('parallel_fill_u8', 'parallel_fill_u64', 'parallel_fill_u8_nt', 'parallel_fill_u64_nt')
+_fill_u8 = _fill_u64 = _fill_u8_nt = _fill_u64_nt = _data_ptr = None
+if _lib is not None:
+    for _name in ('parallel_fill_u8', 'parallel_fill_u64'):
+        _kernel = getattr(_lib, _name + '_nt' + _kernel_suffix, None)
+        if _kernel is not None:
+            _kernel.argtypes = getattr(_lib, _name).argtypes
+            _kernel.restype = None
+    _fill_u8, _fill_u64, _fill_u8_nt, _fill_u64_nt = (getattr(_lib, n + _kernel_suffix, None) for n in _KERNELS)
+    _data_ptr = lambda array: array.ctypes.data
+    try:
+        import cffi
+        _ffi = cffi.FFI()
+        _ffi.cdef("""
+            void parallel_fill_u8(void* data, size_t size_bytes, uint8_t value, int num_threads);
+            void parallel_fill_u64(void* data, size_t num_elements, uint64_t value, int num_threads);
+            void parallel_fill_u8_avx512(void* data, size_t size_bytes, uint8_t value, int num_threads);
+            void parallel_fill_u64_avx512(void* data, size_t num_elements, uint64_t value, int num_threads);
+            void parallel_fill_u8_nt(void* data, size_t size_bytes, uint8_t value, int num_threads);
+            void parallel_fill_u64_nt(void* data, size_t num_elements, uint64_t value, int num_threads);
+            void parallel_fill_u8_nt_avx512(void* data, size_t size_bytes, uint8_t value, int num_threads);
+            void parallel_fill_u64_nt_avx512(void* data, size_t num_elements, uint64_t value, int num_threads);
+        """)
+        _ffi_lib = _ffi.dlopen(lib_path)
+        # 只替换 ctypes 中存在的入口 (cffi 访问库中不存在的符号时才报错)
+        _fill_u8, _fill_u64, _fill_u8_nt, _fill_u64_nt = (
+            getattr(_ffi_lib, n + _kernel_suffix) if k is not None else None
+            for n, k in zip(_KERNELS, (_fill_u8, _fill_u64, _fill_u8_nt, _fill_u64_nt))
+        )
+        # from_buffer 只接受 C 连续的缓冲区；F 连续数组的转置是同一块内存上的 C 连续视图
+        _data_ptr = lambda array: _ffi.from_buffer(array if array.flags.c_contiguous else array.T)
+    except (ImportError, OSError, AttributeError):
+        pass
+
+_isect_i64 = getattr(_lib, 'intersection_volumes_i64', None) if _lib is not None else None
+_fill_u8_batch = getattr(_lib, 'parallel_fill_u8_batch', None) if _lib is not None else None
+_fill_u64_batch = getattr(_lib, 'parallel_fill_u64_batch', None) if _lib is not None else None
+_fill_u8_nt_batch = getattr(_lib, 'parallel_fill_u8_nt_batch', None) if _lib is not None else None
+_fill_u64_nt_batch = getattr(_lib, 'parallel_fill_u64_nt_batch', None) if _lib is not None else None
+
+def pin_cpus(start, count=1):
     """
-    计算两个扁平 BBox [x1, y1, z1, x2, y2, z2] 的相交体积
+    把当前进程绑定到允许集合 (经 cgroup / taskset 限制后的 sched_getaffinity) 中
+    从 start 开始的 count 个核，超出核数时回绕。
+    不支持或失败时返回 None，降级为由内核调度。
     """
-    # 提取坐标
-    ax1, ay1, az1, ax2, ay2, az2 = bbox_a
-    bx1, by1, bz1, bx2, by2, bz2 = bbox_b
-    
+    try:
+        allowed = sorted(os.sched_getaffinity(0))
+        cpus = {allowed[(start + i) % len(allowed)] for i in range(count)}
+        os.sched_setaffinity(0, cpus)
+    except (AttributeError, OSError) as e:
+        print(f"Warning: CPU pinning unavailable ({e}), leaving placement to the kernel.")
+        return None
+    return sorted(cpus)
+
+@_jit
+def _intersection_volume(ax1, ay1, az1, ax2, ay2, az2, bx1, by1, bz1, bx2, by2, bz2):
+    """12 个标量参数 (Numba 对标量参数的编译结果最好，省去元组解包)"""
     # 计算相交区域
     ix1 = max(ax1, bx1)
     iy1 = max(ay1, by1)
@@ -61,13 +159,112 @@ def calc_intersection_volume(bbox_a, bbox_b):
     
     return (ix2 - ix1) * (iy2 - iy1) * (iz2 - iz1)
 
+def calc_intersection_volume(bbox_a, bbox_b):
+    """
+    计算两个扁平 BBox [x1, y1, z1, x2, y2, z2] 的相交体积
+    """
+    return _intersection_volume(*bbox_a, *bbox_b)
+
+def calc_intersection_volumes(boxes_a, boxes_b, num_threads=1):
+    """
+    calc_intersection_volume 的向量化版本: boxes_a / boxes_b 为 (..., 6) 的整数数组，按 NumPy 规则广播，
+    返回 (...) 的相交体积。例如 (N, 6) 对单个 (6,) 查询即一次算出 N 个交集。
+    两者都是 int64、且形状相同或其中一个为单个 (6,) 时走 C++ 融合内核 (无中间数组)，
+    num_threads > 1 且 bbox 数很多时多线程计算。
+    """
+    boxes_a = np.asarray(boxes_a)
+    boxes_b = np.asarray(boxes_b)
+    if boxes_b.shape != (6,) and boxes_a.shape == (6,):
+        boxes_a, boxes_b = boxes_b, boxes_a
+    if (_isect_i64 is not None and boxes_a.dtype == np.int64 and boxes_b.dtype == np.int64
+            and boxes_a.shape[-1:] == (6,) and boxes_b.shape in ((6,), boxes_a.shape)):
+        boxes_a = np.ascontiguousarray(boxes_a)
+        boxes_b = np.ascontiguousarray(boxes_b)
+        out = np.empty(boxes_a.shape[:-1], dtype=np.int64)
+        _isect_i64(boxes_a.ctypes.data, boxes_b.ctypes.data, 6 if boxes_b.ndim > 1 else 0,
+                   out.ctypes.data, out.size, num_threads)
+        return out
+
+    lo = np.maximum(boxes_a[..., :3], boxes_b[..., :3])
+    hi = np.minimum(boxes_a[..., 3:], boxes_b[..., 3:])
+    d = np.subtract(hi, lo, out=hi)
+    np.maximum(d, 0, out=d)
+    return d.prod(axis=-1)
+
+def uncovered_regions(bbox, bounds, order='C'):
+    """
+    返回扁平 BBox [x1, y1, z1, x2, y2, z2] 中落在 bounds 之外的区域。
+    结果为局部坐标下的 (slice_x, slice_y, slice_z) 列表，各区域互不重叠；
+    bbox 完全落在 bounds 内时返回空列表。
+    先切出内存布局中最外层轴 (C 序为 X，F 序为 Z) 两侧的整片，这两片在内存中连续 (单通道时)。
+    """
+    x1, y1, z1, x2, y2, z2 = bbox
+    bx1, by1, bz1, bx2, by2, bz2 = bounds
+
+    ix1, iy1, iz1 = max(x1, bx1), max(y1, by1), max(z1, bz1)
+    ix2, iy2, iz2 = min(x2, bx2), min(y2, by2), min(z2, bz2)
+
+    # 完全不相交：整个 bbox 都需要填充
+    if ix1 >= ix2 or iy1 >= iy2 or iz1 >= iz2:
+        return [(slice(0, x2 - x1), slice(0, y2 - y1), slice(0, z2 - z1))]
+
+    lows, highs, inners = (x1, y1, z1), (x2, y2, z2), ((ix1, ix2), (iy1, iy2), (iz1, iz2))
+    regions = []
+    # 已切过的轴限制在相交范围内，未切过的轴取整段
+    region = [slice(None)] * 3
+    for axis in ((0, 1, 2) if order == 'C' else (2, 1, 0)):
+        lo, hi = lows[axis], highs[axis]
+        i1, i2 = inners[axis]
+        if lo < i1:
+            region[axis] = slice(0, i1 - lo)
+            regions.append(tuple(region))
+        if i2 < hi:
+            region[axis] = slice(i2 - lo, None)
+            regions.append(tuple(region))
+        region[axis] = slice(i1 - lo, i2 - lo)
+
+    return regions
+
+@_jit
+def _spread_bits_3d(v):
+    """把低 21 位展开到每 3 位一位 (SWAR magic bits)"""
+    v &= 0x1fffff
+    v = (v | (v << 32)) & 0x1f00000000ffff
+    v = (v | (v << 16)) & 0x1f0000ff0000ff
+    v = (v | (v << 8)) & 0x100f00f00f00f00f
+    v = (v | (v << 4)) & 0x10c30c30c30c30c3
+    v = (v | (v << 2)) & 0x1249249249249249
+    return v
+
+@_jit
 def morton_code_3d(x, y, z):
     """
-    简化的 Z-Order (Morton Code) 计算，用于兜底路由
-    实际生产可用 pymorton 库，这里简单模拟
+    Z-Order (Morton Code) 计算，用于兜底路由
+    坐标先按 32 体素量化，每轴取 21 位做位交叉
     """
-    # 简单异或哈希替代，实际应使用位交叉
-    return hash((x >> 5, y >> 5, z >> 5))
+    return (_spread_bits_3d(x >> 5)
+            | (_spread_bits_3d(y >> 5) << 1)
+            | (_spread_bits_3d(z >> 5) << 2))
+
+if njit is not None:
+    @njit(cache=True, parallel=True)
+    def _morton_codes_3d(xs, ys, zs):
+        out = np.empty(xs.shape[0], dtype=np.int64)
+        for i in prange(xs.shape[0]):
+            out[i] = morton_code_3d(xs[i], ys[i], zs[i])
+        return out
+else:
+    def _morton_codes_3d(xs, ys, zs):
+        # 纯 Python 时 morton_code_3d 的位运算直接作用于整个 int64 数组
+        return morton_code_3d(xs, ys, zs)
+
+def morton_codes_3d(xs, ys, zs):
+    """morton_code_3d 的批量版本: 三个等长的一维坐标序列，返回 int64 数组"""
+    return _morton_codes_3d(
+        np.ascontiguousarray(xs, dtype=np.int64),
+        np.ascontiguousarray(ys, dtype=np.int64),
+        np.ascontiguousarray(zs, dtype=np.int64),
+    )
 
 def _fast_fill(buffer, shape, dtype_str, parallel, value, order ='F'):
     """
@@ -80,55 +277,226 @@ def _fast_fill(buffer, shape, dtype_str, parallel, value, order ='F'):
     fast_fill(arr, value, num_threads= parallel)
 
 
-def fast_fill(array: np.ndarray, value: int, num_threads: int = 4):
+def _numpy_fill(array, value, num_threads):
+    # 目前 C++ 只实现了 u8 和 u64，其他类型回退到 Numpy
+    print(f"warning, fast_fill use numpy.fill()")
+    array.fill(value)
+
+# C++ 内核直接支持的 dtype (只含本机字节序；大端 int64 等按值写入会错位，交给 NumPy)
+_U64_DTYPES = frozenset({np.dtype('int64'), np.dtype('uint64')})
+_U8_DTYPES = frozenset({np.dtype('int8'), np.dtype('uint8'), np.dtype('bool')})
+
+def _resolve_fill(key):
+    """
+    按 (dtype, value == 0, 是否在 mmap 映射上) 选出填充函数并缓存。
+    分发结果只取决于这三项，同类数组之后的调用直接取缓存，不再逐项判断。
+    映射上的数组 (共享内存) 填充后由其他进程读取，有 *_nt 入口时改用强制流式存储的版本。
+    """
+    dtype, is_zero, mapped = key
+    fill_u8 = _fill_u8_nt if mapped and _fill_u8_nt is not None else _fill_u8
+    fill_u64 = _fill_u64_nt if mapped and _fill_u64_nt is not None else _fill_u64
+
+    # 策略 A: 如果 value 是 0，所有类型都等价于 memset 0
+    # 这是最高效的路径，支持 float, int32, int64 等所有类型
+    if is_zero:
+        def fill(array, value, num_threads, fill_u8=fill_u8, data_ptr=_data_ptr):
+            fill_u8(data_ptr(array), array.nbytes, 0, num_threads)
+
+    # 策略 B: 64位整数 (uint64, int64)
+    # 只有当 value != 0 时才需要专门处理类型
+    elif dtype in _U64_DTYPES:
+        if fill_u64 is not None:
+            def fill(array, value, num_threads, fill_u64=fill_u64, data_ptr=_data_ptr):
+                # C++ 接口要求 num_elements，不是 nbytes；按 64 位补码取值 (处理 int64 负数情况)
+                fill_u64(data_ptr(array), array.size, int(value) & 0xFFFFFFFFFFFFFFFF, num_threads)
+        else:
+            def fill(array, value, num_threads):
+                array.fill(value) # 没编译新库则回退
+
+    # 策略 C: 8位整数 (uint8, int8, bool)
+    elif dtype in _U8_DTYPES:
+        def fill(array, value, num_threads, fill_u8=fill_u8, data_ptr=_data_ptr):
+            fill_u8(data_ptr(array), array.nbytes, int(value) & 0xFF, num_threads)
+
+    # 策略 D: 其他情况 (如 uint32=0x1234, float=1.5)
+    else:
+        fill = _numpy_fill
+
+    _dispatch_cache[key] = fill
+    return fill
+
+_dispatch_cache = {}
+
+def _is_mapped(array):
+    """数组是否在 mmap 映射上 (wrap_shm 返回的数组，或 SharedMemory.buf 上的视图)"""
+    base = array.base
+    while isinstance(base, np.ndarray):
+        base = base.base
+    if isinstance(base, memoryview):
+        base = base.obj
+    return isinstance(base, mmap.mmap)
+
+_libc = ctypes.CDLL(None, use_errno=True)
+_libc.mincore.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_void_p]
+
+def _anon_private(lo, hi):
+    """
+    [lo, hi) 是否整段落在可写的私有匿名映射内 (/proc/self/maps 中无路径名或为 [heap])。
+    文件映射 (np.memmap、/dev/shm 上的共享内存等) 的页不驻留时读出的是文件内容而不是 0。
+    """
+    try:
+        with open('/proc/self/maps') as f:
+            lines = f.readlines()
+    except OSError:
+        return False
+    pos = lo
+    for line in lines:
+        fields = line.split(None, 5)
+        start, end = (int(x, 16) for x in fields[0].split('-'))
+        if end <= pos:
+            continue
+        if start > pos:
+            return False
+        perms = fields[1]
+        if perms[1] != 'w' or perms[3] != 'p' or (len(fields) > 5 and fields[5].strip() not in ('', '[heap]')):
+            return False
+        pos = end
+        if pos >= hi:
+            return True
+    return False
+
+def _zero_untouched(array):
+    """
+    prefault=False 的 0 填充捷径。
+    只用于私有匿名内存 (np.empty / np.zeros 等；文件映射与共享内存直接返回 False)，
+    只检查完全落在 [data, data + nbytes) 内的页 (mincore)：从未写过的匿名页读出来全是 0。
+    头尾不满一页的部分与其他数据共页 (glibc 的 mmap 分配从页内 16 字节处开始，首页存放 malloc 块头，必定驻留)，
+    直接 memset 为 0。内部的页都未驻留时返回 True (数组已全 0，且内部页不分配物理内存)；否则返回 False，由调用方正常填充。
+    页被换出到 swap 时同样报告为不驻留，因此只应在确知数组刚分配时使用。
+    """
+    flags = array.flags
+    if not (flags.c_contiguous or flags.f_contiguous):
+        return False
+    page = mmap.PAGESIZE
+    start = array.ctypes.data
+    end = start + array.nbytes
+    lo = (start + page - 1) // page * page
+    hi = end // page * page
+    if hi <= lo or _is_mapped(array) or not _anon_private(lo, hi):
+        return False
+    vec = np.empty((hi - lo) // page, dtype=np.uint8)
+    if _libc.mincore(lo, hi - lo, vec.ctypes.data) != 0 or (vec & 1).any():
+        return False
+    ctypes.memset(start, 0, lo - start)
+    ctypes.memset(hi, 0, end - hi)
+    return True
+
+def fast_zeros(shape, dtype, order='C'):
+    """
+    全 0 数组: 直接用 np.zeros (calloc，大块内存由 mmap 分配)，不写任何数据。
+    内核把未写过的页映射到共享的零页，读到的全是 0 而不占物理内存，直到真正写入时才逐页分配。
+    只需要 "内容为 0" 时应使用它，而不是 np.empty + fast_fill(array, 0)：
+    后者会立即为整个数组分配并写入物理页 (1GB 即 1GB RSS 与数百毫秒)。
+    需要预先建立页表、避免之后写入时缺页的场合 (如 Worker 的 _prefault) 仍用 fast_fill。
+    """
+    return np.zeros(shape, dtype=dtype, order=order)
+
+def fast_fill(array: np.ndarray, value: int, num_threads: int = 4, prefault: bool = True):
     """
     智能分发填充任务到 C++ AVX2 函数
     支持 uint8 和 uint64 的高性能填充
+    prefault=False 且 value 为 0 时，若数组在私有匿名内存上且内部的页都还没有物理页 (刚由 mmap / calloc 分配，读出即为 0)
+    则只写头尾不满一页的部分，不为写 0 分配物理内存 (见 fast_zeros 与 _zero_untouched)
     """
+    # 每个属性 / 全局名只取一次 (小数组时 fast_fill 的耗时主要是这些查找)
+    is_zero = bool(value == 0)
+    if not prefault and is_zero and _zero_untouched(array):
+        return
+
     #  库未加载，回退
-    if _lib is None:
+    if _fill_u8 is None:
         print(f"warning, _lib not found, fast_fill use numpy.fill()")
         array.fill(value)
         return
 
     # 连续性检查
-    if not (array.flags['C_CONTIGUOUS'] or array.flags['F_CONTIGUOUS']):
+    flags = array.flags
+    if not (flags.c_contiguous or flags.f_contiguous):
         print("Warning: Array not contiguous, fallback to numpy")
         array.fill(value)
         return
 
-    data_ptr = array.ctypes.data
-    
-    # 策略分发
-    
-    # 策略 A: 如果 value 是 0，所有类型都等价于 memset 0
-    # 这是最高效的路径，支持 float, int32, int64 等所有类型
-    if value == 0:
-        _lib.parallel_fill_u8(data_ptr, array.nbytes, 0, num_threads)
+    # 内联 _is_mapped
+    base = array.base
+    while isinstance(base, np.ndarray):
+        base = base.base
+    if isinstance(base, memoryview):
+        base = base.obj
+
+    key = (array.dtype, is_zero, isinstance(base, mmap.mmap))
+    fill = _dispatch_cache.get(key) or _resolve_fill(key)
+    fill(array, value, num_threads)
+
+def _call_fill_batch(kernel, items, value_dtype, size_attr, num_threads):
+    """把 (array, value) 列表打包成指针 / 长度 / 值三个数组，一次调用批量入口"""
+    n = len(items)
+    ptrs = np.fromiter((array.ctypes.data for array, _ in items), dtype=np.uintp, count=n)
+    counts = np.fromiter((getattr(array, size_attr) for array, _ in items), dtype=np.uintp, count=n)
+    values = np.fromiter((value for _, value in items), dtype=value_dtype, count=n)
+    kernel(ptrs.ctypes.data, counts.ctypes.data, values.ctypes.data, n, num_threads)
+
+def fast_fill_batch(arrays, values, num_threads: int = 4):
+    """
+    一次 C++ 调用填充多个数组 (所有数组切块后在同一个 OpenMP 并行区内动态分配)，
+    适合大量小块：省去逐块的 ctypes 调用与并行区创建开销。
+    values 为标量 (所有数组同一填充值) 或与 arrays 等长的序列。
+    可按字节填充的 (值为 0 或 8 位类型) 与 64 位整数各合并为一次调用，
+    其余数组 (其他类型的非 0 值、不连续数组) 逐个交给 fast_fill；旧库没有批量入口时全部逐个 fast_fill。
+    与 fast_fill 相同，mmap 映射上的数组 (共享内存) 另合并为 *_nt 批量调用 (强制流式存储)；
+    旧库没有 *_nt 批量入口时这些数组逐个交给 fast_fill，仍走 *_nt 内核。
+    """
+    if np.ndim(values) == 0:
+        values = [values] * len(arrays)
+    if _fill_u8_batch is None:
+        for array, value in zip(arrays, values):
+            fast_fill(array, value, num_threads)
         return
 
-    # 策略 B: 64位整数 (uint64, int64)
-    # 只有当 value != 0 时才需要专门处理类型
-    if array.itemsize == 8 and np.issubdtype(array.dtype, np.integer):
-        # C++ 接口要求 num_elements，不是 nbytes
-        num_elements = array.size
-        # 强制转换为 c_uint64 (处理 int64 负数情况)
-        c_val = ctypes.c_uint64(int(value))
-        
-        if hasattr(_lib, 'parallel_fill_u64'):
-            _lib.parallel_fill_u64(data_ptr, num_elements, c_val, num_threads)
+    # 下标 0 / 1: 普通 / 映射上的数组
+    u8, u64 = ([], []), ([], [])
+    for array, value in zip(arrays, values):
+        if not (array.flags.c_contiguous or array.flags.f_contiguous):
+            fast_fill(array, value, num_threads)
+            continue
+        mapped = _is_mapped(array)
+        if mapped and _fill_u8_nt_batch is None:
+            fast_fill(array, value, num_threads)
+        elif value == 0 or array.dtype in _U8_DTYPES:
+            u8[mapped].append((array, int(value) & 0xFF))
+        elif array.dtype in _U64_DTYPES and _fill_u64_batch is not None:
+            u64[mapped].append((array, int(value) & 0xFFFFFFFFFFFFFFFF))
         else:
-            array.fill(value) # 没编译新库则回退
-        return
+            fast_fill(array, value, num_threads)
 
-    # 策略 C: 8位整数 (uint8, int8)
-    if array.itemsize == 1:
-        val_byte = int(value) & 0xFF
-        _lib.parallel_fill_u8(data_ptr, array.nbytes, val_byte, num_threads)
-        return
+    for kernel, items in ((_fill_u8_batch, u8[0]), (_fill_u8_nt_batch, u8[1])):
+        if items:
+            _call_fill_batch(kernel, items, np.uint8, 'nbytes', num_threads)
+    for kernel, items in ((_fill_u64_batch, u64[0]), (_fill_u64_nt_batch, u64[1])):
+        if items:
+            _call_fill_batch(kernel, items, np.uint64, 'size', num_threads)
 
-    # 策略 D: 其他情况 (如 uint32=0x1234, float=1.5)
-    # 目前 C++ 只实现了 u8 和 u64，其他类型回退到 Numpy
-    print(f"warning, fast_fill use numpy.fill()")
-    array.fill(value)
-    
\ No newline at end of file
+# 可选的 Cython 分发器 (_fast_fill_cy.pyx，未编译时使用上面的纯 Python 版本)。
+# 行为与 fast_fill 相同，按 type_num 直接分发并以数组指针调用内核，省去每次调用的属性查找与 ctypes 参数转换
+try:
+    import _fast_fill_cy
+except ImportError:
+    _fast_fill_cy = None
+
+if _fast_fill_cy is not None and _lib is not None and _fill_u8 is not None:
+    def _kernel_addr(name):
+        kernel = getattr(_lib, name + _kernel_suffix, None)
+        return ctypes.cast(kernel, ctypes.c_void_p).value if kernel is not None else 0
+
+    _fast_fill_cy.init(*(_kernel_addr(n) for n in _KERNELS), _zero_untouched)
+    _py_fast_fill = fast_fill
+    fast_fill = _fast_fill_cy.fast_fill